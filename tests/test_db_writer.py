@@ -0,0 +1,22 @@
+import pytest
+
+from zyspotify.db import SQLiteDBManager
+
+
+def test_unopened_db_is_a_no_op():
+    manager = SQLiteDBManager()
+    manager.flush()
+    manager.commit()
+    manager.close_all()
+    with pytest.raises(RuntimeError):
+        manager.submit(lambda: None)
+
+
+def test_submit_after_close_raises(tmp_path):
+    manager = SQLiteDBManager()
+    manager.create_db(tmp_path)
+    manager.set_liked_watermark("2024-01-01T00:00:00Z", should_commit=True)
+    manager.close_all()
+    manager.close_all()
+    with pytest.raises(RuntimeError):
+        manager.set_liked_watermark("2024-01-02T00:00:00Z")
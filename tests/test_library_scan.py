@@ -0,0 +1,81 @@
+import pytest
+
+from zyspotify.db import ID_STORAGES, SQLiteDBManager
+
+SONG_ID = "4uLU6hMCjMI75M1A2tKUQC"
+ALBUM_ID = "6N9PS4QXF1D0OWPk0Sxtb4"
+ARTIST_ID = "0gxyHStUsqpMadRV0Di1Qt"
+
+
+def open_db(db_dir, id_storage):
+    manager = SQLiteDBManager()
+    manager.create_db(db_dir, id_storage=id_storage)
+    return manager
+
+
+def record_scan(db_dir, id_storage, files):
+    """One --scan-library run, lyrics are fetched for songs that lack them"""
+    manager = open_db(db_dir, id_storage)
+    manager.store_library_files(files, should_commit=True)
+    fetched = []
+    for song_id, _ in files:
+        if not manager.have_lyrics_downloaded(song_id):
+            fetched.append(song_id)
+            manager.set_lyrics_downloaded(song_id, should_commit=True)
+    manager.close_all()
+    return fetched
+
+
+@pytest.mark.parametrize("id_storage", ID_STORAGES)
+def test_scanned_song_lyrics_are_kept(tmp_path, id_storage):
+    files = [(SONG_ID, tmp_path / "song.mp3")]
+    assert record_scan(tmp_path, id_storage, files) == [SONG_ID]
+    assert record_scan(tmp_path, id_storage, files) == []
+
+
+@pytest.mark.parametrize("id_storage", ID_STORAGES)
+def test_lyrics_move_with_promoted_song(tmp_path, id_storage):
+    record_scan(tmp_path, id_storage, [(SONG_ID, tmp_path / "song.mp3")])
+
+    manager = open_db(tmp_path, id_storage)
+    manager.store_artist((ARTIST_ID, "artist"))
+    manager.store_all_artist_albums(ARTIST_ID, [{"id": ALBUM_ID, "name": "album"}])
+    manager.store_album_songs(
+        [
+            {
+                "id": SONG_ID,
+                "album_id": ALBUM_ID,
+                "artist_id": ARTIST_ID,
+                "name": "song",
+                "track_number": 1,
+                "disc_number": 1,
+                "quality_kbps": 320,
+            }
+        ],
+        should_commit=True,
+    )
+    manager.close_all()
+
+    manager = open_db(tmp_path, id_storage)
+    assert manager.have_song_downloaded(SONG_ID)
+    assert manager.have_lyrics_downloaded(SONG_ID)
+    assert manager.get_songs_missing_lyrics() == []
+    manager.close_all()
+
+
+def test_scan_finds_tagged_file(tmp_path):
+    id3 = pytest.importorskip("mutagen.id3")
+    pytest.importorskip("music_tag")
+    from zyspotify.library_scanner import scan_library
+
+    music_dir = tmp_path / "music"
+    (music_dir / "artist").mkdir(parents=True)
+    song_path = music_dir / "artist" / "song.mp3"
+    tags = id3.ID3()
+    tags.add(id3.COMM(encoding=3, text=f"https://open.spotify.com/track/{SONG_ID}"))
+    tags.save(song_path)
+
+    files = scan_library(music_dir)
+    assert files == [(SONG_ID, song_path)]
+    assert record_scan(tmp_path, "text", files) == [SONG_ID]
+    assert record_scan(tmp_path, "text", scan_library(music_dir)) == []
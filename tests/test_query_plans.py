@@ -0,0 +1,60 @@
+import ast
+import inspect
+
+import pytest
+
+from zyspotify import db as db_module
+from zyspotify.db import (
+    FULL_SCAN_QUERIES,
+    ID_STORAGES,
+    QUERIES,
+    SELECT_ALBUM_SONGS,
+    SELECT_ARTIST_ALBUMS,
+    SELECT_SONGS_MISSING_LYRICS,
+    SQLiteDBManager,
+)
+
+DML = ("SELECT", "INSERT", "UPDATE", "DELETE")
+
+
+@pytest.fixture(params=ID_STORAGES)
+def db(request, tmp_path):
+    manager = SQLiteDBManager()
+    manager.create_db(tmp_path, id_storage=request.param)
+    yield manager
+    manager.close_all()
+
+
+def test_queries_do_not_scan(db):
+    assert db.find_table_scans() == []
+
+
+def test_full_scans_are_queries():
+    assert all(query in QUERIES for query in FULL_SCAN_QUERIES)
+
+
+def test_no_inline_sql():
+    """Statements passed as literals would be missed by the plan checks"""
+    inline = [
+        node.args[0].value
+        for node in ast.walk(ast.parse(inspect.getsource(db_module)))
+        if isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Attribute)
+        and node.func.attr in ("execute", "executemany")
+        and node.args
+        and isinstance(node.args[0], ast.Constant)
+        and node.args[0].value.lstrip().upper().startswith(DML)
+    ]
+    assert inline == []
+
+
+@pytest.mark.parametrize(
+    "query, index",
+    [
+        (SELECT_ARTIST_ALBUMS, "COVERING INDEX albums_by_artist"),
+        (SELECT_ALBUM_SONGS, "COVERING INDEX songs_by_album"),
+        (SELECT_SONGS_MISSING_LYRICS, "COVERING INDEX songs_missing_lyrics"),
+    ],
+)
+def test_covering_indexes_are_used(db, query, index):
+    assert any(index in detail for detail in db.query_plan(query))
@@ -1,14 +1,20 @@
 import sys
-import time
 import requests
 from getpass import getpass
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 import importlib.metadata as metadata
 import os
 from .custom_types import *
 from .db import db_manager
-from .respot import Respot, RespotUtils, API_PLAYLIST
+from .http_client import http_client
+from .library_scanner import scan_library
+from .response_cache import response_cache
+from .scheduler import request_scheduler
+from .respot import Respot, RespotUtils
 from .tagger import AudioTagger
+from .transcoder import finish_part
 from .utils import FormatUtils
 from .arg_parser import parse_args
 import logging
@@ -27,6 +33,7 @@ _USERNAME = os.environ.get("USERNAME", None)
 _PASSWORD = os.environ.get("PASSWORD", None)
 
 GENERIC_MAX_STR_LEN = 50
+REPAIR_LYRICS_WAIT = 2
 
 # using __name__ instead of the root logger seems to be the "proper" way, but:
 # librespot logs crap to INFO that we don't care about
@@ -43,6 +50,9 @@ class ZYSpotify:
             force_premium=self.args.force_premium,
             audio_format=self.args.audio_format,
             antiban_wait_time=self.args.antiban_time,
+            stream_to_disk=self.args.stream_to_disk,
+            transcoder=self.args.transcoder,
+            transcode_workers=self.args.transcode_workers,
             cli_args=self.args,
         )
         self.search_limit = self.args.limit
@@ -54,8 +64,31 @@ class ZYSpotify:
 
         self.album_in_filename = self.args.album_in_filename
         self.antiban_album_time = self.args.antiban_album
+        request_scheduler.set_spacing("album", self.antiban_album_time)
+        request_scheduler.set_spacing("lyrics", REPAIR_LYRICS_WAIT)
         self.not_skip_existing = self.args.not_skip_existing
-        self.tagger = AudioTagger()
+        self.tagger = AudioTagger(
+            Path(self.args.dbdir) / "art_cache",
+            self.args.art_cache_size_mb * 1024 * 1024,
+            art_max_size=self.args.art_max_size,
+            art_quality=self.args.art_quality,
+            cover_art=self.args.cover_art,
+        )
+        http_client.configure(pool_size=self.args.http_pool_size)
+
+        # separate pools so album workers can wait on their tracks without deadlocking
+        self.workers = max(1, self.args.workers)
+        self.track_pool = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="track"
+        )
+        self.album_pool = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="album"
+        )
+        # one thread per transcode process, each waits on a conversion then tags the file
+        self.finalize_pool = ThreadPoolExecutor(
+            max_workers=max(1, self.args.transcode_workers),
+            thread_name_prefix="finalize",
+        )
 
         self.log_dir_path = Path(self.args.log_dir)
         self.log_dir_path.mkdir(exist_ok=True)
@@ -124,13 +157,29 @@ class ZYSpotify:
         else:
             os.system("clear")
 
-    @staticmethod
-    def antiban_wait(seconds=5):
-        """Pause between albums for a set number of seconds"""
-        for i in range(seconds)[::-1]:
-            print(f"\rSleep for {i + 1} second(s)...", end="")
-            time.sleep(1)
-        print("\n")
+    def run_jobs(self, pool: ThreadPoolExecutor, func, jobs: list[tuple]) -> list:
+        """Runs func for each args tuple, on the pool when more than one worker is configured"""
+        if self.workers == 1:
+            return [func(*args) for args in jobs]
+
+        futures = [pool.submit(func, *args) for args in jobs]
+        # result() re-raises worker exceptions, same as running inline would
+        return [future.result() for future in futures]
+
+    def shutdown_workers(self, cancel: bool = False) -> None:
+        """Waits for the pools to finish their jobs, with cancel queued jobs are dropped first"""
+        pools = [self.album_pool, self.track_pool, self.respot.transcode_pool, self.finalize_pool]
+        if self.respot.request is not None:
+            pools.append(self.respot.request.page_pool)
+        pools = [pool for pool in pools if pool is not None]
+
+        if cancel:
+            # cancel every queue before waiting on any pool, a running album
+            # job would otherwise keep waiting on tracks still queued behind it
+            for pool in pools:
+                pool.shutdown(wait=False, cancel_futures=True)
+        for pool in pools:
+            pool.shutdown(wait=True)
 
     @staticmethod
     def zfill(value, length=2):
@@ -209,9 +258,6 @@ class ZYSpotify:
         return filename
 
     def download_track(self, track_id, path=None, caller=None):
-
-        lyrics_path: str = ""
-
         if not db_manager.have_song_downloaded(track_id):
             if caller == "show" or caller == "episode":
                 track = self.respot.request.get_episode_info(track_id)
@@ -229,7 +275,6 @@ class ZYSpotify:
             audio_name = track.get("audio_name")
             audio_number = track.get("audio_number")
             artist_name = track.get("artist_name")
-            album_artist = track.get("album_artist")
             album_name = track.get("album_name")
 
             filename = self.generate_filename(
@@ -256,51 +301,135 @@ class ZYSpotify:
                     logger.info(f"Skipping {filename + ext} - Already downloaded")
                     return True
 
+            # tags go on the temp file, the library file is written once
+            tag = partial(self.tag_track, track) if self.args.single_pass_tagging else None
             try:
                 output_path = self.respot.download(
-                    track_id, temp_path, self.args.audio_format, True
+                    track_id, temp_path, self.args.audio_format, True, tag
                 )
             except CouldntDecodeError as e:
-
-                # https://github.com/jiaaro/pydub/issues/757#issuecomment-1812953496
-                # seems like a limitation of pydub and .wav files not being bigger than 4GB uncompressed ~668M files fail for me here
-                # TODO: is this fixable?
-                # for now its ok to just skip the file, do it here since the exit is cleaner
-                # stricly check the error message and only skip this specific one
-
-                if str(e) == "Unable to process >4GB files":
-                    logger.error(f"Song was too large to convert: track_id: {track_id} ")
+                if self.is_too_large_to_convert(track_id, e):
                     return
+                raise
 
             if output_path == "":
                 return
 
-            logger.info(f"Setting audiotags {filename}")
-            self.tagger.set_audio_tags(
-                output_path,
-                artists=artist_name,
-                name=audio_name,
-                album_name=album_name,
-                release_year=track["release_year"],
-                disc_number=track["disc_number"],
-                track_number=audio_number,
-                album_artist=album_artist,
-                track_id_str=track["scraped_song_id"],
-                image_url=track["image_url"],
-            )
-
-            db_manager.set_song_downloaded(
-                track_id, Path(output_path), should_commit=True
-            )
-            logger.info(f"Finished downloading {filename}")
+            if isinstance(output_path, Future):
+                # tag and record once the transcode stage hands the file back
+                return self.finalize_pool.submit(
+                    self.finish_track, track_id, track, filename, output_path, caller, tag
+                )
 
-            lyrics_path = output_path
+            self.finish_track(track_id, track, filename, output_path, caller, tag)
         else:
             logger.info(f"Skipping song {track_id}, already downloaded")
 
             # need to get song path from db
-            lyrics_path = db_manager.get_song_path(track_id)
+            self.download_lyrics(track_id, db_manager.get_song_path(track_id))
+
+    @staticmethod
+    def is_too_large_to_convert(track_id, e: CouldntDecodeError) -> bool:
+        # only raised by the pydub transcoder, the ffmpeg pipe has no such limit
+        # https://github.com/jiaaro/pydub/issues/757#issuecomment-1812953496
+        # seems like a limitation of pydub and .wav files not being bigger than 4GB uncompressed ~668M files fail for me here
+        # TODO: is this fixable?
+        # for now its ok to just skip the file, do it here since the exit is cleaner
+        # stricly check the error message and only skip this specific one
+
+        if str(e) == "Unable to process >4GB files":
+            logger.error(f"Song was too large to convert: track_id: {track_id} ")
+            return True
+        return False
+
+    def finish_track(
+        self, track_id, track, filename, output_path, caller=None, tag=None
+    ) -> None:
+        """Tags the downloaded file and records it, waiting on its conversion if it was queued.
+        With tag the file is already tagged, or a queued conversion hands back its temp file to tag"""
+        if isinstance(output_path, Future):
+            try:
+                output_path = output_path.result()
+            except CouldntDecodeError as e:
+                if self.is_too_large_to_convert(track_id, e):
+                    return
+                raise
 
+            if tag is not None:
+                output_path = finish_part(*output_path, tag)
+
+        if tag is None:
+            self.tag_track(track, output_path)
+        # other callers mix songs of many albums in one folder
+        if caller == "album" and self.tagger.cover_file:
+            self.tagger.write_cover_file(Path(output_path).parent, track["image_url"])
+
+        db_manager.set_song_downloaded(track_id, Path(output_path), should_commit=True)
+        logger.info(f"Finished downloading {filename}")
+
+        self.download_lyrics(track_id, output_path)
+
+    def tag_track(self, track, path) -> bool:
+        logger.info(f"Setting audiotags {Path(path).name}")
+        return self.tagger.set_audio_tags(
+            path,
+            artists=track.get("artist_name"),
+            name=track.get("audio_name"),
+            album_name=track.get("album_name"),
+            release_year=track["release_year"],
+            disc_number=track["disc_number"],
+            track_number=track.get("audio_number"),
+            album_artist=track.get("album_artist"),
+            track_id_str=track["scraped_song_id"],
+            image_url=track["image_url"],
+        )
+
+    def scan_library(self) -> None:
+        """Records the songs already in the music and episodes dirs, so they are not downloaded again"""
+        for directory in (self.music_dir, self.episodes_dir):
+            if not directory.exists():
+                continue
+            files = scan_library(directory, self.args.scan_workers)
+            stored = db_manager.store_library_files(files, should_commit=True)
+            logger.info(f"Recorded {stored} new songs from {directory}")
+
+    def retag_library(self) -> None:
+        """Rewrites the tags of downloaded songs from stored metadata, without downloading them again"""
+        songs = [
+            (track_id, path)
+            for track_id, path in db_manager.get_downloaded_song_paths()
+            if path and Path(path).exists()
+        ]
+        # songs downloaded before metadata was stored, fetched in batches up front
+        self.respot.request.get_tracks_info(
+            [
+                track_id
+                for track_id, _ in songs
+                if not db_manager.have_track_metadata(track_id)
+            ]
+        )
+        # the retag workers read metadata on their own connections, which only see committed rows
+        db_manager.flush()
+
+        # always pooled, --workers paces downloads and defaults to 1
+        with ThreadPoolExecutor(
+            max_workers=max(1, self.args.retag_workers), thread_name_prefix="retag"
+        ) as pool:
+            futures = [pool.submit(self.retag_track, *song) for song in songs]
+            results = [future.result() for future in futures]
+        logger.info(f"Retagged {sum(results)} of {len(songs)} songs")
+
+    def retag_track(self, track_id, path) -> bool:
+        track = db_manager.get_track_metadata(track_id)
+        if track is None:
+            track = self.respot.request.get_track_info(track_id)
+        if track is None:
+            logger.error(f"Skipping {path} - Could not get track info")
+            return False
+
+        return self.tag_track(track, path)
+
+    def download_lyrics(self, track_id, lyrics_path) -> None:
         # check if need to dl lyrics here
         if (
             not db_manager.have_lyrics_downloaded(track_id)
@@ -311,15 +440,21 @@ class ZYSpotify:
 
             self.respot.request.request_song_lyrics(track_id, lyrics_path)
 
+    @staticmethod
+    def wait_finalized(results: list) -> None:
+        """Blocks until tracks handed to the transcode stage are tagged and recorded"""
+        for result in results:
+            if isinstance(result, Future):
+                result.result()
+
     def download_playlist_artists(self, playlist_id):
         playlist = self.respot.request.get_playlist_info(playlist_id)
         if not playlist:
             logger.error("Playlist not found")
             return False
 
-        # todo: cache this request
-        packed_artists = self.respot.request.request_all_playlist_artists(
-            f"{API_PLAYLIST}/{playlist_id}/tracks"
+        packed_artists = self.respot.request.get_playlist_artists(
+            playlist_id, playlist["snapshot_id"]
         )
 
         logger.info(f"Downloading [{len(packed_artists)}] artists")
@@ -334,7 +469,7 @@ class ZYSpotify:
             return False
         for playlist in playlists["playlists"]:
             self.download_playlist_artists(playlist["id"])
-            self.antiban_wait(self.antiban_album_time)
+            request_scheduler.release("album")
         logger.info("Finished downloading all user playlists")
 
     def download_select_user_playlists(self):
@@ -379,7 +514,7 @@ class ZYSpotify:
 
         for playlist in playlist_ids:
             self.download_playlist_artists(playlist)
-            self.antiban_wait(self.antiban_album_time)
+            request_scheduler.release("album")
         logger.info("Finished downloading selected playlists")
 
     def download_album(
@@ -414,13 +549,21 @@ class ZYSpotify:
 
             logger.info(f"Downloading {artists} - {album_name} album")
 
+            # only albums with songs left to download are spaced out
+            pending = [
+                song["id"] for song in songs if not db_manager.have_song_downloaded(song["id"])
+            ]
+            if pending:
+                request_scheduler.wait_turn("album")
+
+            # one request per 50 songs instead of one per song
+            prefetched = self.respot.request.prefetch_tracks_info(pending)
+
             # Concat download path
             basepath = self.music_dir / artists / album_name
 
-            self.respot
+            jobs = []
             for song in songs:
-                # if song already downloaded, skip
-
                 # Append disc number to filepath if more than 1 disc
                 newBasePath = basepath
                 if disc_number_flag:
@@ -429,7 +572,19 @@ class ZYSpotify:
                     )
                     newBasePath = basepath / disc_number
 
-                self.download_track(song["id"], newBasePath, "album")
+                jobs.append((song["id"], newBasePath, "album"))
+
+            try:
+                results = self.run_jobs(self.track_pool, self.download_track, jobs)
+            finally:
+                self.respot.request.release_tracks_info(prefetched)
+
+            # antiban gap starts now, tagging and converting keep going during it
+            if pending:
+                request_scheduler.release("album")
+
+            # only marked complete once every track is downloaded, converted and tagged
+            self.wait_finalized(results)
 
             db_manager.set_album_fully_downloaded(album_id, should_commit=True)
             logger.info(
@@ -441,28 +596,48 @@ class ZYSpotify:
         return True
 
     def download_artist(self, artist_id: SpotifyArtistId):
+        refresh_albums = (
+            not self.args.force_album_query
+            and self.respot.request.claim_album_refresh(artist_id)
+        )
 
         if (
             not db_manager.have_artist_already_downloaded(artist_id)
             or self.args.force_album_query
+            or refresh_albums
         ):
 
             artist_name = self.respot.request.get_artist_info(artist_id)["name"]
 
             if self.args.force_album_query:
                 logger.info(f"[Forced] fetching albums for artist {artist_name}")
+            elif refresh_albums:
+                logger.info(f"[Stale] fetching albums for artist {artist_name}")
 
             # just attempt insert of artist, it may not exist already
             db_manager.store_artist((artist_id, artist_name), should_commit=True)
 
-            albums_ids = self.respot.request.get_artist_albums(artist_id)
+            albums_ids = self.respot.request.get_artist_albums(
+                artist_id, refresh=refresh_albums
+            )
             if not albums_ids:
                 logger.error(f"Artist {artist_id} has no albums")
                 return False
-            for album_id in albums_ids:
-                # only preform antiban wait if we actually downloaded something
-                if self.download_album(album_id, artist_id):
-                    self.antiban_wait(self.antiban_album_time)
+
+            # after a refresh this is just the new releases
+            pending_album_ids = [
+                album_id
+                for album_id in albums_ids
+                if not db_manager.have_album_already_downloaded(album_id)
+            ]
+
+            # one request per 20 albums instead of album info plus tracklist per album
+            self.respot.request.prefetch_albums_info(pending_album_ids, artist_id)
+            self.run_jobs(
+                self.album_pool,
+                self.download_album,
+                [(album_id, artist_id) for album_id in pending_album_ids],
+            )
 
             db_manager.set_artist_fully_downloaded(artist_id, should_commit=True)
             logger.info(f"Finished downloading {artist_id} artist")
@@ -484,8 +659,14 @@ class ZYSpotify:
             return False
         logger.info("Downloading liked songs")
         basepath = self.music_dir / "Liked Songs"
-        for song in songs:
-            self.download_track(song["id"], basepath, "liked_songs")
+        prefetched = self.respot.request.prefetch_tracks_info(
+            [song["id"] for song in songs]
+        )
+        try:
+            for song in songs:
+                self.download_track(song["id"], basepath, "liked_songs")
+        finally:
+            self.respot.request.release_tracks_info(prefetched)
         logger.info("Finished downloading liked songs")
         return True
 
@@ -602,12 +783,26 @@ class ZYSpotify:
             return
 
         db_dir = Path(self.args.dbdir)
-        db_manager.create_db(db_dir)
+        db_manager.create_db(
+            db_dir,
+            profile=self.args.db_profile,
+            commit_every=self.args.db_commit_every,
+            commit_interval=self.args.db_commit_interval,
+            id_storage=self.args.db_id_storage,
+        )
         logger.info(f"DB ready at {db_dir.absolute() / 'zyspotify.db'}")
+        response_cache.open(
+            db_dir / "http_cache.db", self.args.http_cache_size_mb * 1024 * 1024
+        )
+
+        # local files only, no login needed
+        if self.args.scan_library:
+            self.scan_library()
+            return
 
         try:
             logger.debug(
-                f"Public IP: {requests.get('https://api.ipify.org', timeout=5).content.decode('utf8')}"
+                f"Public IP: {http_client.get('https://api.ipify.org', timeout=5).content.decode('utf8')}"
             )
         except requests.exceptions.RequestException:
             logger.error("IP check failed")
@@ -620,13 +815,11 @@ class ZYSpotify:
             raise NotImplementedError()
             self.download_all_user_playlists()
         elif self.args.repair_lyrics:
-            custom_cursor = db_manager.connection.cursor()
-            custom_cursor.execute(
-                "SELECT song_id, full_filepath FROM songs WHERE lyrics_downloaded = 0 AND download_completed = 1"
-            )
-            for row in custom_cursor:
+            for row in db_manager.get_songs_missing_lyrics():
+                request_scheduler.wait_turn("lyrics")
                 self.respot.request.request_song_lyrics(row[0], row[1])
-                self.antiban_wait(2)
+        elif self.args.retag:
+            self.retag_library()
         elif self.args.select_playlists:
             raise NotImplementedError()
             self.download_select_user_playlists()
@@ -708,8 +901,14 @@ def main():
 
     try:
         zys.start()
+        # let queued conversions finish tagging before exiting
+        zys.shutdown_workers()
+        db_manager.flush()
+        response_cache.close()
     except KeyboardInterrupt:
         logger.error("Interrupted by user")
+        # running jobs still write to the db, let them end before it closes
+        zys.shutdown_workers(cancel=True)
         db_manager.commit()
         db_manager.close_all()
         sys.exit(0)
@@ -2,10 +2,17 @@ import argparse
 from pathlib import Path
 import os
 import logging
+from .db import DB_PROFILES, DEFAULT_COMMIT_EVERY, DEFAULT_COMMIT_INTERVAL_SEC, ID_STORAGES
+from .http_client import DEFAULT_POOL_SIZE
+from .library_scanner import DEFAULT_SCAN_WORKERS
+from .art_cache import COVER_ART_MODES, DEFAULT_ART_CACHE_SIZE_MB
+from .response_cache import DEFAULT_CACHE_SIZE_MB
+from .transcoder import TRANSCODERS
 
 _ANTI_BAN_WAIT_TIME = os.environ.get("ANTI_BAN_WAIT_TIME", 4)
 _ANTI_BAN_WAIT_TIME_ALBUMS = os.environ.get("ANTI_BAN_WAIT_TIME_ALBUMS", 4)
 _LIMIT_RESULTS = os.environ.get("LIMIT_RESULTS", 10)
+_WORKERS = os.environ.get("WORKERS", 1)
 
 
 def parse_args():
@@ -79,6 +86,30 @@ def parse_args():
         help="Folder to save the database",
         default=Path.home() / "zyspotify_config",
     )
+    parser.add_argument(
+        "--db-profile",
+        help="Storage profile of the database. 'wal' enables write ahead logging with grouped commits and lets other tools read the db during a run",
+        default="default",
+        choices=DB_PROFILES,
+    )
+    parser.add_argument(
+        "--db-commit-every",
+        help="With --db-profile wal, commit after this many state changes",
+        default=DEFAULT_COMMIT_EVERY,
+        type=int,
+    )
+    parser.add_argument(
+        "--db-commit-interval",
+        help="With --db-profile wal, commit pending state changes at least this often (seconds)",
+        default=DEFAULT_COMMIT_INTERVAL_SEC,
+        type=float,
+    )
+    parser.add_argument(
+        "--db-id-storage",
+        help="How spotify ids are stored. 'compact' converts the db once to integer keys, which makes it and its indexes smaller. Defaults to what the db already uses",
+        default=None,
+        choices=ID_STORAGES,
+    )
     parser.add_argument(
         "-pd",
         "--episodes-dir",
@@ -98,6 +129,69 @@ def parse_args():
         default="mp3",
         choices=["mp3", "ogg", "source"],
     )
+    parser.add_argument(
+        "--http-pool-size",
+        help="Keep-alive connections kept open per host for api, lyrics and cover art requests",
+        default=DEFAULT_POOL_SIZE,
+        type=int,
+    )
+    parser.add_argument(
+        "--http-cache-size-mb",
+        help="Size of the on-disk cache of artist, album, show and playlist info responses, 0 disables it",
+        default=DEFAULT_CACHE_SIZE_MB,
+        type=int,
+    )
+    parser.add_argument(
+        "--art-cache-size-mb",
+        help="Size of the on-disk cover art cache, 0 keeps covers in memory only",
+        default=DEFAULT_ART_CACHE_SIZE_MB,
+        type=int,
+    )
+    parser.add_argument(
+        "--art-max-size",
+        help="Scale cover art down to fit this many pixels before it is saved, 0 keeps the size spotify serves",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--art-quality",
+        help="JPEG quality cover art is re-encoded at (1-95), 0 keeps the original unless it is resized",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--cover-art",
+        help="Embed cover art in every file, write one cover.jpg per album folder, or both",
+        default="embed",
+        choices=COVER_ART_MODES,
+    )
+    parser.add_argument(
+        "-spt",
+        "--single-pass-tagging",
+        help="Tag the temp file before it is moved into the library, so each file is written in place once",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--transcoder",
+        help="Backend used to convert audio. ffmpeg streams through a pipe with constant memory, pydub decodes the whole file first. Falls back to pydub if only avconv is installed",
+        default="ffmpeg",
+        choices=TRANSCODERS,
+    )
+    parser.add_argument(
+        "-tw",
+        "--transcode-workers",
+        help="Number of processes converting audio in the background while downloads continue, 0 converts inline",
+        default=os.cpu_count() or 1,
+        type=int,
+    )
+    parser.add_argument(
+        "-std",
+        "--stream-to-disk",
+        help="Write audio to a temp file next to the target while downloading instead of buffering whole tracks in memory",
+        action="store_true",
+        default=False,
+    )
     parser.add_argument(
         "--album-in-filename",
         help="Adds the album name to the filename",
@@ -119,6 +213,13 @@ def parse_args():
     parser.add_argument(
         "--limit", help="Search limit", default=_LIMIT_RESULTS, type=int
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Number of tracks (per album) and albums (per artist) to download at the same time",
+        default=_WORKERS,
+        type=int,
+    )
     parser.add_argument(
         "-f",
         "--force-premium",
@@ -140,6 +241,13 @@ def parse_args():
         action="store_true",
         default=False,
     )
+    parser.add_argument(
+        "-slaq",
+        "--sync-liked-artist-query",
+        help="Only query songs liked since the last liked artists query and add their artists. Usually one request instead of the whole library.",
+        action="store_true",
+        default=False,
+    )
 
     parser.add_argument(
         "-sl",
@@ -156,6 +264,18 @@ def parse_args():
         action="store_true",
         default=False,
     )
+    parser.add_argument(
+        "--album-query-ttl-days",
+        help="Query an artist's albums again once the stored list is older than this many days. Only new releases are downloaded",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--album-query-budget",
+        help="With --album-query-ttl-days, query at most this many stale artists per run",
+        default=None,
+        type=int,
+    )
     parser.add_argument(
         "-rl",
         "--repair-lyrics",
@@ -163,6 +283,32 @@ def parse_args():
         action="store_true",
         default=False,
     )
+    parser.add_argument(
+        "-rt",
+        "--retag",
+        help="Rewrite the tags of every downloaded song from stored metadata, files already tagged alike are skipped",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--retag-workers",
+        help="Number of files --retag reads and rewrites at the same time",
+        default=os.cpu_count() or 1,
+        type=int,
+    )
+    parser.add_argument(
+        "-scl",
+        "--scan-library",
+        help="Record the songs already in the music dir as downloaded, read from the track url in their tags. Rebuilds the db after it was lost or the library moved",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--scan-workers",
+        help="Number of threads listing folders and reading tags during --scan-library",
+        default=DEFAULT_SCAN_WORKERS,
+        type=int,
+    )
     parser.add_argument(
         "-bd", "--bulk-download", help="Bulk download from file with urls"
     )
@@ -0,0 +1,174 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, Optional
+
+from PIL import Image
+
+logger = logging.getLogger()
+
+DEFAULT_ART_CACHE_SIZE_MB = 256
+DEFAULT_ART_QUALITY = 90
+# embedded in every file, a cover.jpg per album folder, or both
+COVER_ART_MODES = ["embed", "file", "both"]
+# covers of the albums currently being tagged, a few albums can be in flight with workers
+MEMORY_ITEMS = 8
+
+
+class ArtCache:
+    """Cover art by image url, so an album's cover is fetched once and not per track.
+
+    Recently used covers stay in memory. On disk, images are stored once per
+    content hash under objects/, and urls/ maps a url hash to the content hash.
+    The least recently used images are evicted once the store exceeds max_bytes.
+    Tracks asking for a cover that is being fetched wait for that fetch.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[str], Optional[bytes]],
+        cache_dir: Optional[Path] = None,
+        max_bytes: int = 0,
+        variant: str = "",
+    ):
+        """
+        Args:
+            variant (str): Names how fetch transforms the image, entries of other variants are not reused.
+        """
+        self.fetch = fetch
+        self.variant = variant
+        self.cache_dir = cache_dir if max_bytes > 0 else None
+        self.max_bytes = max_bytes
+        self.memory: OrderedDict[str, bytes] = OrderedDict()
+        self.pending: dict[str, Future] = {}
+        self.lock = threading.Lock()
+        self.disk_lock = threading.Lock()
+
+        if self.cache_dir is not None:
+            Path.mkdir(self.cache_dir / "objects", parents=True, exist_ok=True)
+            Path.mkdir(self.cache_dir / "urls", parents=True, exist_ok=True)
+
+    def get(self, url: str) -> Optional[bytes]:
+        """Cover for url, None if it could not be fetched"""
+        if self.variant:
+            url = f"{url}#{self.variant}"
+
+        with self.lock:
+            if (data := self.memory.get(url)) is not None:
+                self.memory.move_to_end(url)
+                return data
+
+            if (future := self.pending.get(url)) is not None:
+                owner = False
+            else:
+                future = self.pending[url] = Future()
+                owner = True
+
+        if not owner:
+            return future.result()
+
+        try:
+            data = self._read(url)
+            if data is None:
+                data = self.fetch(url.split("#", 1)[0])
+                if data:
+                    self._write(url, data)
+
+            if data:
+                with self.lock:
+                    self.memory[url] = data
+                    while len(self.memory) > MEMORY_ITEMS:
+                        self.memory.popitem(last=False)
+            future.set_result(data)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.pending[url]
+
+        return data
+
+    @staticmethod
+    def _hash(value: bytes) -> str:
+        return hashlib.sha256(value).hexdigest()
+
+    def _read(self, url: str) -> Optional[bytes]:
+        if self.cache_dir is None:
+            return None
+
+        try:
+            content_hash = (self.cache_dir / "urls" / self._hash(url.encode())).read_text()
+            object_path = self.cache_dir / "objects" / content_hash
+            data = object_path.read_bytes()
+            # mtime is the recency used for eviction
+            os.utime(object_path)
+        except FileNotFoundError:
+            return None
+
+        return data
+
+    def _write(self, url: str, data: bytes) -> None:
+        if self.cache_dir is None:
+            return
+
+        content_hash = self._hash(data)
+        object_path = self.cache_dir / "objects" / content_hash
+        url_path = self.cache_dir / "urls" / self._hash(url.encode())
+
+        # written under a temporary name and renamed, readers never see half a file
+        with self.disk_lock:
+            if not object_path.exists():
+                part_path = object_path.with_name(object_path.name + ".part")
+                part_path.write_bytes(data)
+                os.replace(part_path, object_path)
+            part_path = url_path.with_name(url_path.name + ".part")
+            part_path.write_text(content_hash)
+            os.replace(part_path, url_path)
+
+            self._evict()
+
+    def _evict(self) -> None:
+        objects = [
+            (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+            for entry in os.scandir(self.cache_dir / "objects")
+            if not entry.name.endswith(".part")
+        ]
+        total = sum(size for _, size, _ in objects)
+        if total <= self.max_bytes:
+            return
+
+        # url entries of evicted objects stay behind and read as a miss
+        for _, size, path in sorted(objects):
+            os.unlink(path)
+            total -= size
+            if total <= self.max_bytes:
+                break
+        logger.debug("Evicted least recently used cover art from the art cache")
+
+
+def normalize_cover_art(data: bytes, max_size: int, quality: int) -> bytes:
+    """Scales the image down to fit max_size (0 keeps the size) and re-encodes it as jpeg"""
+    try:
+        with Image.open(BytesIO(data)) as image:
+            # jpeg has no alpha or palette
+            image = image.convert("RGB")
+            resized = max_size > 0 and max(image.size) > max_size
+            if resized:
+                image.thumbnail((max_size, max_size), Image.LANCZOS)
+
+            output = BytesIO()
+            image.save(output, "JPEG", quality=quality, optimize=True)
+    except OSError as e:
+        logger.warning(f"Could not normalize cover art, keeping the original: {e}")
+        return data
+
+    # re-encoding an image that already fits can come out bigger
+    if not resized and output.tell() >= len(data):
+        return data
+    return output.getvalue()
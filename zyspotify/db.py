@@ -1,11 +1,29 @@
 # from .types import SpotifyArtistId
 
+import functools
+import logging
+import re
 import sqlite3
+import queue
+import threading
+import time
+from concurrent.futures import Future
 from typing import Optional
 from datetime import datetime
 from pathlib import Path
 
 from .custom_types import *
+from .utils import IdUtils
+
+logger = logging.getLogger()
+
+DB_PROFILES = ["default", "wal"]
+# "text" keeps the base62 ids in every table, "compact" stores integer keys mapped through spotify_ids
+ID_STORAGES = ["text", "compact"]
+DEFAULT_COMMIT_EVERY = 100
+DEFAULT_COMMIT_INTERVAL_SEC = 5.0
+# readers wait this long for a commit in progress instead of failing with "database is locked"
+BUSY_TIMEOUT_SEC = 30.0
 
 CREATE_ARTISTS_TABLE = """
 CREATE TABLE IF NOT EXISTS artists (
@@ -83,6 +101,94 @@ CREATE TABLE IF NOT EXISTS fetched_songs (
 );
 """
 
+# everything the tagger needs, so re-runs can tag without asking spotify again
+CREATE_ALBUM_METADATA_TABLE = """
+CREATE TABLE IF NOT EXISTS album_metadata (
+    album_id TEXT NOT NULL PRIMARY KEY,
+    name TEXT NOT NULL,
+    album_artist TEXT NOT NULL,
+    release_date TEXT NOT NULL,
+    image_url TEXT DEFAULT NULL
+);
+"""
+
+CREATE_TRACK_METADATA_TABLE = """
+CREATE TABLE IF NOT EXISTS track_metadata (
+    song_id TEXT NOT NULL PRIMARY KEY,
+    scraped_song_id TEXT NOT NULL,
+    album_id TEXT NOT NULL,
+    artist_id TEXT NOT NULL,
+    artist_name TEXT NOT NULL,
+    name TEXT NOT NULL,
+    disc_number INTEGER NOT NULL,
+    track_number INTEGER NOT NULL,
+    is_playable INTEGER NOT NULL,
+    FOREIGN KEY (album_id)
+    REFERENCES album_metadata (album_id)
+       ON UPDATE CASCADE
+);
+"""
+
+# one row per id, base62 ids are stored as their 16 byte value and anything else as text
+CREATE_SPOTIFY_IDS_TABLE = """
+CREATE TABLE IF NOT EXISTS spotify_ids (
+    id_key INTEGER PRIMARY KEY,
+    spotify_id BLOB NOT NULL UNIQUE
+);
+"""
+
+CREATE_ID_STORAGE_TABLE = """
+CREATE TABLE IF NOT EXISTS id_storage (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    mode TEXT NOT NULL
+);
+"""
+
+# tables whose *_id columns hold spotify ids, parents before children
+ID_TABLES = [
+    "artists",
+    "albums",
+    "songs",
+    "fetched_albums",
+    "fetched_songs",
+    "album_metadata",
+    "track_metadata",
+    "playlists",
+    "playlist_artists",
+    "library_files",
+]
+
+# snapshot changes whenever the playlist does, the artists are only re-read then
+CREATE_PLAYLISTS_TABLE = """
+CREATE TABLE IF NOT EXISTS playlists (
+    playlist_id TEXT NOT NULL PRIMARY KEY,
+    snapshot TEXT NOT NULL
+);
+"""
+
+CREATE_PLAYLIST_ARTISTS_TABLE = """
+CREATE TABLE IF NOT EXISTS playlist_artists (
+    playlist_id TEXT NOT NULL,
+    artist_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (playlist_id, artist_id),
+    FOREIGN KEY (playlist_id)
+    REFERENCES playlists (playlist_id)
+       ON UPDATE CASCADE
+       ON DELETE CASCADE
+);
+"""
+
+# songs found on disk by --scan-library that have no songs row yet, the songs table
+# needs album and artist rows. Moved over once the album's songs are stored
+CREATE_LIBRARY_FILES_TABLE = """
+CREATE TABLE IF NOT EXISTS library_files (
+    song_id TEXT NOT NULL PRIMARY KEY,
+    full_filepath TEXT NOT NULL,
+    lyrics_downloaded INTEGER NOT NULL DEFAULT 0
+);
+"""
+
 CREATE_CREDENTIALS_TABLE = """
 CREATE TABLE IF NOT EXISTS credentials (
     id INTEGER PRIMARY KEY CHECK (id = 0),
@@ -93,20 +199,297 @@ CREATE TABLE IF NOT EXISTS credentials (
 """
 
 
+# every statement the db runs lives here, tests/test_query_plans.py checks the
+# plan of each one and fails on a full table scan not listed in FULL_SCAN_QUERIES.
+# migrations and the id conversion build per table sql and are not included
+
+# bulk loaded at startup into the in memory DownloadedIndex
+SELECT_DOWNLOADED_SONGS = "SELECT song_id FROM songs WHERE download_completed = 1"
+SELECT_LYRICS_SONGS = "SELECT song_id FROM songs WHERE lyrics_downloaded = 1"
+SELECT_DOWNLOADED_ALBUMS = "SELECT album_id FROM albums WHERE download_completed = 1"
+SELECT_DOWNLOADED_ARTISTS = "SELECT artist_id FROM artists WHERE download_completed = 1"
+SELECT_LIBRARY_SONGS = "SELECT song_id FROM library_files"
+SELECT_LIBRARY_LYRICS_SONGS = "SELECT song_id FROM library_files WHERE lyrics_downloaded = 1"
+SELECT_SPOTIFY_IDS = "SELECT id_key, spotify_id FROM spotify_ids"
+
+SELECT_ID_STORAGE = "SELECT mode FROM id_storage WHERE id = 0"
+INSERT_ID_STORAGE = "INSERT INTO id_storage (id, mode) VALUES (0, ?)"
+UPDATE_ID_STORAGE = "UPDATE id_storage SET mode = ? WHERE id = 0"
+INSERT_SPOTIFY_ID = "INSERT INTO spotify_ids (spotify_id) VALUES (?)"
+SELECT_TABLE_SQL = "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?"
+
+SELECT_HAVE_ALL_ARTIST_ALBUMS = "SELECT have_fetched_all_albums FROM fetched_albums WHERE artist_id = ?"
+SELECT_ARTIST_ALBUMS = "SELECT album_id FROM albums WHERE artist_id = ?"
+SELECT_ARTIST_ALBUMS_CHECKED = "SELECT last_checked FROM fetched_albums WHERE artist_id = ?"
+INSERT_ALBUM = "INSERT OR IGNORE INTO albums (album_id, artist_id, name) VALUES (?, ?, ?)"
+UPSERT_HAVE_ALL_ARTIST_ALBUMS = """
+INSERT INTO fetched_albums (artist_id, have_fetched_all_albums, last_checked)
+VALUES (?, ?, ?) ON CONFLICT (artist_id)
+DO UPDATE SET have_fetched_all_albums=excluded.have_fetched_all_albums, last_checked=excluded.last_checked
+"""
+
+SELECT_HAVE_ALL_LIKED_ARTISTS = "SELECT have_fetched_all_artists FROM fetched_artists WHERE id = 0"
+SELECT_ALL_ARTISTS = "SELECT artist_id FROM artists"
+SELECT_LIKED_WATERMARK = "SELECT liked_added_at FROM fetched_artists WHERE id = 0"
+UPSERT_HAVE_ALL_LIKED_ARTISTS = """
+INSERT INTO fetched_artists (id, have_fetched_all_artists)
+VALUES (?, ?) ON CONFLICT (id)
+DO UPDATE SET have_fetched_all_artists=excluded.have_fetched_all_artists
+"""
+UPSERT_LIKED_WATERMARK = """
+INSERT INTO fetched_artists (id, liked_added_at)
+VALUES (0, ?) ON CONFLICT (id)
+DO UPDATE SET liked_added_at=excluded.liked_added_at
+"""
+INSERT_ARTIST = "INSERT OR IGNORE INTO artists (artist_id, name) VALUES (?, ?)"
+UPDATE_ARTIST_DOWNLOADED = "UPDATE artists SET download_completed = ?, timestamp_completed = ? WHERE artist_id = ?"
+UPDATE_ALBUM_DOWNLOADED = "UPDATE albums SET download_completed = ?, timestamp_completed = ? WHERE album_id = ?"
+
+SELECT_HAVE_ALL_ALBUM_SONGS = "SELECT have_fetched_all_songs_in_album FROM fetched_songs WHERE album_id = ?"
+SELECT_ALBUM_SONGS = "SELECT song_id, album_id, artist_id, name, track_number, disc_number, quality_kbps FROM songs WHERE album_id = ?"
+INSERT_SONG = "INSERT OR IGNORE INTO songs (song_id, album_id, artist_id, name, track_number, disc_number, quality_kbps) VALUES (?, ?, ?, ?, ?, ?, ?)"
+UPSERT_HAVE_ALL_ALBUM_SONGS = """
+INSERT INTO fetched_songs (album_id, have_fetched_all_songs_in_album)
+VALUES (?, ?) ON CONFLICT (album_id)
+DO UPDATE SET have_fetched_all_songs_in_album=excluded.have_fetched_all_songs_in_album
+"""
+UPDATE_SONG_DOWNLOADED = "UPDATE songs SET full_filepath = ?, download_completed = ?, timestamp_completed = ? WHERE song_id = ?"
+SELECT_SONG_PATH = "SELECT full_filepath FROM songs WHERE song_id = ?"
+UPDATE_LYRICS_DOWNLOADED = "UPDATE songs SET lyrics_downloaded = ? WHERE song_id = ?"
+SELECT_SONGS_MISSING_LYRICS = "SELECT song_id, full_filepath FROM songs WHERE lyrics_downloaded = 0 AND download_completed = 1"
+SELECT_DOWNLOADED_SONG_PATHS = "SELECT song_id, full_filepath FROM songs WHERE download_completed = 1"
+
+SELECT_LIBRARY_FILE_PATH = "SELECT full_filepath FROM library_files WHERE song_id = ?"
+SELECT_LIBRARY_FILE = "SELECT full_filepath, lyrics_downloaded FROM library_files WHERE song_id = ?"
+UPDATE_LIBRARY_FILE_LYRICS = "UPDATE library_files SET lyrics_downloaded = ? WHERE song_id = ?"
+UPSERT_LIBRARY_FILE = "INSERT OR REPLACE INTO library_files (song_id, full_filepath) VALUES (?, ?)"
+DELETE_LIBRARY_FILE = "DELETE FROM library_files WHERE song_id = ?"
+
+SELECT_CREDENTIALS = "SELECT username, credentials, type FROM credentials WHERE id = 0"
+UPSERT_CREDENTIALS = """
+INSERT INTO credentials (id, username, credentials, type)
+VALUES (?, ?, ?, ?) ON CONFLICT (id)
+DO UPDATE SET username=excluded.username, credentials=excluded.credentials, type=excluded.type
+"""
+
+SELECT_TRACK_METADATA = """
+SELECT t.scraped_song_id, t.album_id, t.artist_id, t.artist_name, t.name, t.disc_number, t.track_number, t.is_playable,
+       a.name, a.album_artist, a.release_date, a.image_url
+FROM track_metadata t JOIN album_metadata a ON a.album_id = t.album_id
+WHERE t.song_id = ?
+"""
+SELECT_HAVE_TRACK_METADATA = "SELECT 1 FROM track_metadata WHERE song_id = ?"
+UPSERT_ALBUM_METADATA = """
+INSERT INTO album_metadata (album_id, name, album_artist, release_date, image_url)
+VALUES (?, ?, ?, ?, ?) ON CONFLICT (album_id)
+DO UPDATE SET name=excluded.name, album_artist=excluded.album_artist,
+release_date=excluded.release_date, image_url=excluded.image_url
+"""
+UPSERT_TRACK_METADATA = """
+INSERT INTO track_metadata (song_id, scraped_song_id, album_id, artist_id, artist_name, name, disc_number, track_number, is_playable)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (song_id)
+DO UPDATE SET scraped_song_id=excluded.scraped_song_id, album_id=excluded.album_id,
+artist_id=excluded.artist_id, artist_name=excluded.artist_name, name=excluded.name,
+disc_number=excluded.disc_number, track_number=excluded.track_number,
+is_playable=excluded.is_playable
+"""
+
+SELECT_PLAYLIST_SNAPSHOT = "SELECT snapshot FROM playlists WHERE playlist_id = ?"
+SELECT_PLAYLIST_ARTISTS = "SELECT artist_id, name FROM playlist_artists WHERE playlist_id = ?"
+UPSERT_PLAYLIST = """
+INSERT INTO playlists (playlist_id, snapshot)
+VALUES (?, ?) ON CONFLICT (playlist_id)
+DO UPDATE SET snapshot=excluded.snapshot
+"""
+DELETE_PLAYLIST_ARTISTS = "DELETE FROM playlist_artists WHERE playlist_id = ?"
+INSERT_PLAYLIST_ARTIST = "INSERT OR IGNORE INTO playlist_artists (playlist_id, artist_id, name) VALUES (?, ?, ?)"
+
+QUERIES = [
+    value
+    for name, value in list(globals().items())
+    if name.startswith(("SELECT_", "INSERT_", "UPDATE_", "UPSERT_", "DELETE_"))
+]
+
+# deliberate full reads, bulk loads and whole library walks
+FULL_SCAN_QUERIES = [
+    SELECT_DOWNLOADED_SONGS,
+    SELECT_LYRICS_SONGS,
+    SELECT_DOWNLOADED_ALBUMS,
+    SELECT_DOWNLOADED_ARTISTS,
+    SELECT_LIBRARY_SONGS,
+    SELECT_LIBRARY_LYRICS_SONGS,
+    SELECT_SPOTIFY_IDS,
+    SELECT_TABLE_SQL,
+    SELECT_ALL_ARTISTS,
+    SELECT_DOWNLOADED_SONG_PATHS,
+]
+
+# covering indexes for the per artist/album listings and the --repair-lyrics scan
+CREATE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS albums_by_artist ON albums (artist_id, album_id)",
+    "CREATE INDEX IF NOT EXISTS songs_by_album ON songs (album_id, song_id, artist_id, name, track_number, disc_number, quality_kbps)",
+    # the filtered columns have to be in the index too, or every row is read from the table
+    "CREATE INDEX IF NOT EXISTS songs_missing_lyrics ON songs (song_id, full_filepath, lyrics_downloaded, download_completed) WHERE lyrics_downloaded = 0 AND download_completed = 1",
+]
+
+
+class DownloadedIndex:
+    """Completed song, lyrics, album and artist ids held in memory for O(1) skip checks.
+
+    Ids are kept as the integers their base62 form encodes, which is smaller
+    than the string. Anything that is not a base62 id is kept as is.
+    """
+
+    def __init__(self) -> None:
+        self.songs: set[int | str] = set()
+        self.lyrics: set[int | str] = set()
+        self.albums: set[int | str] = set()
+        self.artists: set[int | str] = set()
+        # scanned from disk, not in the songs table yet
+        self.library: set[int | str] = set()
+
+    @staticmethod
+    def key(spotify_id: str) -> int | str:
+        number = IdUtils.base62_to_int(spotify_id)
+        return spotify_id if number is None else number
+
+    def load(self, id_set: set, spotify_ids) -> None:
+        id_set.update(self.key(spotify_id) for spotify_id in spotify_ids)
+
+    def add(self, id_set: set, spotify_id: str) -> None:
+        id_set.add(self.key(spotify_id))
+
+    def remove(self, id_set: set, spotify_id: str) -> None:
+        id_set.discard(self.key(spotify_id))
+
+    def has(self, id_set: set, spotify_id: str) -> bool:
+        return self.key(spotify_id) in id_set
+
+
+def writes(method):
+    """Runs the method on the writer thread and waits for it to complete"""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return self.submit(functools.partial(method, self, *args, **kwargs), True)
+
+    return wrapper
+
+
+def reads(method):
+    """Marks a method run on the calling thread's own read connection, which sees committed data"""
+    return method
+
+
+def reads_own_writes(method):
+    """For reads that follow writes of the same run. Runs on the writer while it
+    holds uncommitted writes, which only its connection sees, else like reads
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.dirty:
+            return self.submit(functools.partial(method, self, *args, **kwargs))
+        return method(self, *args, **kwargs)
+
+    return wrapper
+
+
 class SQLiteDBManager:
+    """All writes are serialized through one writer thread and its connection,
+    reads use a connection per thread and see committed data, reads_own_writes
+    methods go to the writer while it has uncommitted writes. Methods keep using
+    self.cursor and self.connection, which resolve to the right connection for the thread.
+
+    Callers always pass and get back spotify id strings, with compact id
+    storage they are converted with _key/_new_key and _id on the way in and out.
+    """
+
     def __init__(self) -> None:
-        ...
+        self.profile = "default"
+        self.commit_every = DEFAULT_COMMIT_EVERY
+        self.commit_interval = DEFAULT_COMMIT_INTERVAL_SEC
+        self.pending_commits = 0
+        self.last_commit = time.monotonic()
+        self.dirty = False
+        self.db_path: Optional[Path] = None
+        self.write_queue: queue.Queue = queue.Queue()
+        self.writer_thread: Optional[threading.Thread] = None
+        # set while the writer takes jobs, guards the queue against puts after close_all
+        self.writer_running = False
+        self.writer_lock = threading.Lock()
+        self.write_connection: Optional[sqlite3.Connection] = None
+        self.local = threading.local()
+        self.index = DownloadedIndex()
+        self.id_storage = "text"
+        self.requested_id_storage: Optional[str] = None
+        self.id_keys: dict[str, int] = {}
+        self.spotify_ids: dict[int, str] = {}
+        self.read_connections: list[sqlite3.Connection] = []
+        self.read_connections_lock = threading.Lock()
 
-    def create_db(self, db_dir: Path):
+    def create_db(
+        self,
+        db_dir: Path,
+        profile: str = "default",
+        commit_every: int = DEFAULT_COMMIT_EVERY,
+        commit_interval: float = DEFAULT_COMMIT_INTERVAL_SEC,
+        id_storage: Optional[str] = None,
+    ):
+        """
+        Args:
+            profile (str): "default" commits every should_commit write with the rollback journal.
+                "wal" uses write ahead logging and groups should_commit writes into one commit
+                per commit_every writes or commit_interval seconds, whichever comes first.
+            id_storage (str): "compact" converts a text id db to integer keys, None keeps
+                what the db already uses. Converting back to text is not supported.
+        """
         Path.mkdir(db_dir, parents=True, exist_ok=True)
 
-        self.connection = sqlite3.connect(
-            db_dir / "zyspotify.db",
+        self.db_path = db_dir / "zyspotify.db"
+        self.profile = profile
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.requested_id_storage = id_storage
+
+        self.writer_thread = threading.Thread(
+            target=self._run_writer, name="db-writer", daemon=True
+        )
+        self.writer_running = True
+        self.writer_thread.start()
+        self.submit(self._create_schema)
+        self.load_index()
+
+    @reads
+    def load_index(self) -> None:
+        self.index = DownloadedIndex()
+        for id_set, query in (
+            (self.index.songs, SELECT_DOWNLOADED_SONGS),
+            (self.index.lyrics, SELECT_LYRICS_SONGS),
+            (self.index.albums, SELECT_DOWNLOADED_ALBUMS),
+            (self.index.artists, SELECT_DOWNLOADED_ARTISTS),
+            (self.index.library, SELECT_LIBRARY_SONGS),
+            (self.index.lyrics, SELECT_LIBRARY_LYRICS_SONGS),
+        ):
+            self.index.load(id_set, (self._id(row[0]) for row in self.cursor.execute(query)))
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            self.db_path,
             detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+            timeout=BUSY_TIMEOUT_SEC,
+            check_same_thread=False,
         )
-        self.connection.execute("PRAGMA foreign_keys = 1")
+        connection.execute("PRAGMA foreign_keys = 1")
+        return connection
+
+    def _create_schema(self) -> None:
+        if self.profile == "wal":
+            # readers (e.g. a status tool) no longer block on the download run.
+            # NORMAL is still crash safe in wal mode, a crash only loses the last group
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            self.connection.execute("PRAGMA synchronous = NORMAL")
 
-        self.cursor = self.connection.cursor()
         self.cursor.execute(CREATE_ARTISTS_TABLE)
         self.cursor.execute(CREATE_ALBUMS_TABLE)
         self.cursor.execute(CREATE_SONGS_TABLE)
@@ -116,18 +499,195 @@ class SQLiteDBManager:
         self.cursor.execute(CREATE_CREDENTIALS_TABLE)
         self.migration_0()
         self.migration_1()
-        self.connection.commit()
+        self.migration_2()
+        self.migration_3()
+        self.migration_4()
+        self.migration_5()
+        self.migration_6()
+        self.migration_7()
+        self.migration_8()
+        self._commit()
+
+        self.id_storage = self.cursor.execute(SELECT_ID_STORAGE).fetchone()[0]
+        if self.id_storage == "compact":
+            self._load_id_map()
+            if self.requested_id_storage == "text":
+                logger.warning("DB already stores compact ids, converting back to text is not supported")
+
+        if self.requested_id_storage == "compact" or self.id_storage == "compact":
+            # on a compact db these are the tables added by migrations since the conversion
+            if tables := self._text_id_tables():
+                self._convert_to_compact_ids(tables)
+
+    def _text_id_tables(self) -> list[str]:
+        """ID_TABLES that still declare TEXT id columns"""
+        return [
+            table
+            for table in ID_TABLES
+            if any(
+                row[1].endswith("_id") and row[2] == "TEXT"
+                for row in self.cursor.execute(f"PRAGMA table_info({table})")
+            )
+        ]
+
+    def _load_id_map(self) -> None:
+        for id_key, stored_id in self.cursor.execute(SELECT_SPOTIFY_IDS):
+            spotify_id = (
+                IdUtils.int_to_base62(int.from_bytes(stored_id, "big"))
+                if isinstance(stored_id, bytes)
+                else stored_id
+            )
+            self.id_keys[spotify_id] = id_key
+            self.spotify_ids[id_key] = spotify_id
+
+    def _key(self, spotify_id: Optional[str]) -> Optional[int | str]:
+        """Column value for an id that is looked up, None with compact storage if it was never stored"""
+        if self.id_storage == "text" or spotify_id is None:
+            return spotify_id
+        return self.id_keys.get(spotify_id)
+
+    def _new_key(self, spotify_id: Optional[str]) -> Optional[int | str]:
+        """Column value for an id that is stored, assigns a key the first time. Writer thread only"""
+        if self.id_storage == "text" or spotify_id is None:
+            return spotify_id
+
+        if (id_key := self.id_keys.get(spotify_id)) is None:
+            number = IdUtils.base62_to_int(spotify_id)
+            stored_id = spotify_id if number is None else number.to_bytes(16, "big")
+            id_key = self.cursor.execute(INSERT_SPOTIFY_ID, (stored_id,)).lastrowid
+            self.spotify_ids[id_key] = spotify_id
+            self.id_keys[spotify_id] = id_key
+        return id_key
+
+    def _id(self, value: Optional[int | str]) -> Optional[str]:
+        """Spotify id for a column value"""
+        if self.id_storage == "text" or value is None:
+            return value
+        return self.spotify_ids[value]
+
+    def _convert_to_compact_ids(self, tables: list[str]) -> None:
+        """Rebuilds tables with integer id columns, in one transaction"""
+        logger.info(f"Converting db ids to compact storage for {', '.join(tables)}, this runs once")
+        previous_id_storage = self.id_storage
+        self.id_storage = "compact"
+        # foreign keys can only be switched outside a transaction, and must be off while tables are swapped
+        self.connection.execute("PRAGMA foreign_keys = 0")
+        self.connection.execute("BEGIN")
+        self.connection.create_function("id_key", 1, self._key, deterministic=True)
+        try:
+            for table in tables:
+                columns = [row[1] for row in self.cursor.execute(f"PRAGMA table_info({table})")]
+                for column in columns:
+                    if column.endswith("_id"):
+                        for (spotify_id,) in self.cursor.execute(
+                            f"SELECT DISTINCT {column} FROM {table}"
+                        ).fetchall():
+                            self._new_key(spotify_id)
+
+                create_sql = self.cursor.execute(SELECT_TABLE_SQL, (table,)).fetchone()[0]
+                # the stored sql includes columns added by migrations
+                create_sql = re.sub(r"\b(\w+_id) TEXT\b", r"\1 INTEGER", create_sql)
+                create_sql = create_sql.replace(f"CREATE TABLE {table}", f"CREATE TABLE {table}_compact", 1)
+
+                select = ", ".join(
+                    f"id_key({column})" if column.endswith("_id") else column for column in columns
+                )
+                self.cursor.execute(create_sql)
+                self.cursor.execute(
+                    f"INSERT INTO {table}_compact ({', '.join(columns)}) SELECT {select} FROM {table}"
+                )
+                self.cursor.execute(f"DROP TABLE {table}")
+                self.cursor.execute(f"ALTER TABLE {table}_compact RENAME TO {table}")
+
+            for create_index in CREATE_INDEXES:
+                self.cursor.execute(create_index)
+            self.cursor.execute(UPDATE_ID_STORAGE, ("compact",))
+            self._commit()
+        except BaseException:
+            self.connection.rollback()
+            # keys handed out in the rolled back transaction are gone
+            self.id_storage = previous_id_storage
+            self.id_keys.clear()
+            self.spotify_ids.clear()
+            if self.id_storage == "compact":
+                self._load_id_map()
+            raise
+        finally:
+            self.connection.create_function("id_key", 1, None)
+            self.connection.execute("PRAGMA foreign_keys = 1")
+
+        for problem in self.cursor.execute("PRAGMA foreign_key_check"):
+            logger.warning(f"DB foreign key violation after id conversion: {problem}")
+        # hand the space of the old text tables back to the filesystem
+        self.connection.execute("VACUUM")
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if threading.current_thread() is self.writer_thread:
+            return self.write_connection
+
+        if (connection := getattr(self.local, "connection", None)) is None:
+            connection = self.local.connection = self._connect()
+            with self.read_connections_lock:
+                self.read_connections.append(connection)
+        return connection
+
+    @property
+    def cursor(self) -> sqlite3.Cursor:
+        return self.connection.cursor()
 
+    def submit(self, job, marks_dirty: bool = False):
+        """Runs job on the writer thread, blocks until it is done and returns its result"""
+        if threading.current_thread() is self.writer_thread:
+            return job()
+
+        future = Future()
+        with self.writer_lock:
+            if not self.writer_running:
+                raise RuntimeError("The db writer is not running, create_db was not called or close_all was")
+            self.write_queue.put((job, marks_dirty, future))
+        return future.result()
+
+    def _run_writer(self) -> None:
+        self.write_connection = self._connect()
+
+        while True:
+            try:
+                job, marks_dirty, future = self.write_queue.get(
+                    timeout=self.commit_interval
+                )
+            except queue.Empty:
+                # bounds how long a group can stay uncommitted while no writes come in
+                if time.monotonic() - self.last_commit >= self.commit_interval:
+                    self._flush()
+                continue
+
+            if job is None:
+                self._flush()
+                self.write_connection.close()
+                future.set_result(None)
+                return
+
+            if marks_dirty:
+                self.dirty = True
+
+            try:
+                future.set_result(job())
+            except BaseException as e:
+                future.set_exception(e)
+
+    @reads
     def have_all_artist_albums(self, artist_id: SpotifyArtistId) -> bool:
         fetched = self.cursor.execute(
-            "SELECT have_fetched_all_albums FROM fetched_albums WHERE artist_id = ?",
-            (artist_id,),
+            SELECT_HAVE_ALL_ARTIST_ALBUMS,
+            (self._key(artist_id),),
         ).fetchone()
         if fetched is None or fetched[0] == 0:
             return False
         else:
             return True
 
+    @writes
     def store_all_artist_albums(
         self,
         artist_id: SpotifyArtistId,
@@ -136,145 +696,196 @@ class SQLiteDBManager:
     ):
         for album in packed_albums:
             self.cursor.execute(
-                "INSERT OR IGNORE INTO albums (album_id, artist_id, name) VALUES (?, ?, ?)",
-                (album["id"], artist_id, album["name"]),
+                INSERT_ALBUM,
+                (self._new_key(album["id"]), self._new_key(artist_id), album["name"]),
             )
         if should_commit:
-            self.connection.commit()
+            self._request_commit()
 
+    @writes
     def set_have_all_artist_albums(
         self, artist_id: SpotifyArtistId, value: bool, should_commit: bool = False
     ):
         param = (
-            artist_id,
+            self._new_key(artist_id),
             int(value),
+            datetime.now().astimezone().isoformat(),
         )  # upsert, insert if none exists, overrite prior with new
-        self.cursor.execute(
-            """INSERT INTO fetched_albums 
-               VALUES (?, ?) ON CONFLICT (artist_id) 
-               DO UPDATE SET have_fetched_all_albums=excluded.have_fetched_all_albums""",
-            param,
-        )
+        self.cursor.execute(UPSERT_HAVE_ALL_ARTIST_ALBUMS, param)
         if should_commit:
-            self.connection.commit()
+            self._request_commit()
 
+    @reads
+    def get_artist_albums_checked(self, artist_id: SpotifyArtistId) -> Optional[str]:
+        """When the artist's album listing was last fetched, None if never or before this was recorded"""
+        fetched = self.cursor.execute(
+            SELECT_ARTIST_ALBUMS_CHECKED, (self._key(artist_id),)
+        ).fetchone()
+        return None if fetched is None else fetched[0]
+
+    @reads_own_writes
     def get_all_artist_albums(self, artist_id: SpotifyArtistId) -> list[SpotifyAlbumId]:
         # you always get a tuple back, just need to index to the first value
 
         result = self.cursor.execute(
-            "SELECT album_id FROM albums WHERE artist_id = ?", (artist_id,)
+            SELECT_ARTIST_ALBUMS, (self._key(artist_id),)
         ).fetchall()
-        return [id[0] for id in result]
+        return [self._id(id[0]) for id in result]
 
+    @reads
     def have_all_liked_artists(self) -> bool:
-        fetched = self.cursor.execute(
-            "SELECT have_fetched_all_artists FROM fetched_artists"
-        ).fetchone()
+        fetched = self.cursor.execute(SELECT_HAVE_ALL_LIKED_ARTISTS).fetchone()
         if fetched is None or fetched[0] == 0:
             return False
         else:
             return True
 
+    @reads_own_writes
     def get_all_liked_artist_ids(self) -> list[SpotifyArtistId]:
         # you always get a tuple back, just need to index to the first value
 
-        result = self.cursor.execute("SELECT artist_id FROM artists").fetchall()
-        return [id[0] for id in result]
+        result = self.cursor.execute(SELECT_ALL_ARTISTS).fetchall()
+        return [self._id(id[0]) for id in result]
 
+    @writes
     def set_have_all_liked_artist(self, value: bool, should_commit: bool = False):
         param = (
             0,
             int(value),
         )  # upsert, insert if none exists, overrite prior with new
-        self.cursor.execute(
-            """INSERT INTO fetched_artists 
-               VALUES (?, ?) ON CONFLICT (id) 
-               DO UPDATE SET have_fetched_all_artists=excluded.have_fetched_all_artists""",
-            param,
-        )
+        self.cursor.execute(UPSERT_HAVE_ALL_LIKED_ARTISTS, param)
 
         if should_commit:
-            self.connection.commit()
+            self._request_commit()
+
+    @reads_own_writes
+    def get_liked_watermark(self) -> Optional[str]:
+        """added_at of the newest liked song seen by the last liked artist query"""
+        fetched = self.cursor.execute(SELECT_LIKED_WATERMARK).fetchone()
+        return None if fetched is None else fetched[0]
 
+    @writes
+    def set_liked_watermark(self, added_at: str, should_commit: bool = False):
+        self.cursor.execute(UPSERT_LIKED_WATERMARK, (added_at,))
+
+        if should_commit:
+            self._request_commit()
+
+    @writes
     def store_all_liked_artists(
         self, packed_artists: list[PackedArtists], should_commit: bool = False
     ) -> None:
         
         # already inserted artists just ignore them
         self.cursor.executemany(
-            "INSERT OR IGNORE INTO artists (artist_id, name) VALUES (?, ?)", packed_artists
+            INSERT_ARTIST,
+            [(self._new_key(artist_id), name) for artist_id, name in packed_artists],
         )
 
         if should_commit:
-            self.connection.commit()
+            self._request_commit()
 
+    @writes
     def store_artist(
         self, artist: PackedArtist, should_commit: bool = False
     ) -> None:
         
         # already inserted artists just ignore them
-        self.cursor.execute(
-            "INSERT OR IGNORE INTO artists (artist_id, name) VALUES (?, ?)", artist
-        )
+        self.cursor.execute(INSERT_ARTIST, (self._new_key(artist[0]), artist[1]))
 
         if should_commit:
-            self.connection.commit()
+            self._request_commit()
 
+    @writes
     def set_artist_fully_downloaded(
         self, artist_id: SpotifyArtistId, should_commit: bool = False
     ) -> None:
-        self.cursor.execute(
-            """UPDATE artists SET download_completed = ?, timestamp_completed = ? WHERE artist_id = ?""",
-            (1, datetime.now().astimezone().isoformat(), artist_id),
-        )
+        if self.cursor.execute(
+            UPDATE_ARTIST_DOWNLOADED,
+            (1, datetime.now().astimezone().isoformat(), self._key(artist_id)),
+        ).rowcount:
+            self.index.add(self.index.artists, artist_id)
         if should_commit:
-            self.connection.commit()
+            self._request_commit()
 
+    @writes
     def set_album_fully_downloaded(
         self, album_id: SpotifyAlbumId, should_commit: bool = False
     ) -> None:
-        self.cursor.execute(
-            """UPDATE albums SET download_completed = ?, timestamp_completed = ? WHERE album_id = ?""",
-            (1, datetime.now().astimezone().isoformat(), album_id),
-        )
+        if self.cursor.execute(
+            UPDATE_ALBUM_DOWNLOADED,
+            (1, datetime.now().astimezone().isoformat(), self._key(album_id)),
+        ).rowcount:
+            self.index.add(self.index.albums, album_id)
         if should_commit:
-            self.connection.commit()
+            self._request_commit()
 
     def have_artist_already_downloaded(self, artist_id: SpotifyArtistId) -> bool:
-        fetched = self.cursor.execute(
-            "SELECT download_completed FROM artists WHERE artist_id = ?", (artist_id,)
-        ).fetchone()
-        if fetched is None or fetched[0] == 0:
-            return False
-        else:
-            return True
+        return self.index.has(self.index.artists, artist_id)
 
     def have_album_already_downloaded(self, album_id: SpotifyAlbumId) -> bool:
-        fetched = self.cursor.execute(
-            "SELECT download_completed FROM albums WHERE album_id = ?", (album_id,)
-        ).fetchone()
-        if fetched is None or fetched[0] == 0:
-            return False
-        else:
-            return True
+        return self.index.has(self.index.albums, album_id)
 
     def commit(self) -> None:
+        if self.writer_running:
+            self.submit(self._commit)
+
+    def _commit(self) -> None:
         self.connection.commit()
+        self.dirty = False
+        self.pending_commits = 0
+        self.last_commit = time.monotonic()
+
+    def request_commit(self) -> None:
+        """Commits now in the default profile, groups commits in the wal profile"""
+        self.submit(self._request_commit)
+
+    def _request_commit(self) -> None:
+        self.pending_commits += 1
+
+        if (
+            self.profile != "wal"
+            or self.pending_commits >= self.commit_every
+            or time.monotonic() - self.last_commit >= self.commit_interval
+        ):
+            self._commit()
+
+    def flush(self) -> None:
+        """Commits whatever is still waiting in the current group"""
+        if self.writer_running:
+            self.submit(self._flush)
+
+    def _flush(self) -> None:
+        if self.dirty:
+            self._commit()
 
     def close_all(self) -> None:
-        self.cursor.close()
-        self.connection.close()
+        # the writer commits what is pending before closing its connection
+        future = Future()
+        with self.writer_lock:
+            if not self.writer_running:
+                return
+            self.writer_running = False
+            self.write_queue.put((None, False, future))
+        future.result()
 
+        with self.read_connections_lock:
+            for connection in self.read_connections:
+                connection.close()
+            self.read_connections.clear()
+
+    @reads_own_writes
     def have_all_album_songs(self, album_id: SpotifyAlbumId) -> bool:
         fetched = self.cursor.execute(
-            "SELECT have_fetched_all_songs_in_album FROM fetched_songs WHERE album_id = ?",
-            (album_id,),
+            SELECT_HAVE_ALL_ALBUM_SONGS,
+            (self._key(album_id),),
         ).fetchone()
         if fetched is None or fetched[0] == 0:
             return False
         else:
             return True
 
+    @writes
     def store_album_songs(
         self,
         packed_songs: PackedSongs,
@@ -282,42 +893,84 @@ class SQLiteDBManager:
     ):
         for song in packed_songs:
             self.cursor.execute(
-                "INSERT OR IGNORE INTO songs (song_id, album_id, artist_id, name, track_number, disc_number, quality_kbps) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                INSERT_SONG,
                 (
-                    song["id"],
-                    song["album_id"],
-                    song["artist_id"],
+                    self._new_key(song["id"]),
+                    self._new_key(song["album_id"]),
+                    self._new_key(song["artist_id"]),
                     song["name"],
                     song["track_number"],
                     song["disc_number"],
                     song["quality_kbps"],
                 ),
             )
+            if self.index.has(self.index.library, song["id"]):
+                self._promote_library_file(song["id"])
+        if should_commit:
+            self._request_commit()
+
+    def _promote_library_file(self, song_id: SpotifySongId) -> None:
+        """Marks a scanned song downloaded now that it has a songs row, with its lyrics state"""
+        song_key = self._key(song_id)
+        fetched = self.cursor.execute(SELECT_LIBRARY_FILE, (song_key,)).fetchone()
+        if fetched is None:
+            return
+
+        full_filepath, lyrics_downloaded = fetched
+        if self.cursor.execute(
+            UPDATE_SONG_DOWNLOADED,
+            (full_filepath, 1, datetime.now().astimezone().isoformat(), song_key),
+        ).rowcount:
+            self.cursor.execute(UPDATE_LYRICS_DOWNLOADED, (lyrics_downloaded, song_key))
+            self.cursor.execute(DELETE_LIBRARY_FILE, (song_key,))
+            self.index.add(self.index.songs, song_id)
+            self.index.remove(self.index.library, song_id)
+
+    @writes
+    def store_library_files(
+        self, files: list[tuple[SpotifySongId, Path]], should_commit: bool = False
+    ) -> int:
+        """Records songs found on disk as downloaded, returns how many were new"""
+        stored = 0
+        now = datetime.now().astimezone().isoformat()
+        for song_id, file_path in files:
+            if self.have_song_downloaded(song_id):
+                continue
+
+            if self.cursor.execute(
+                UPDATE_SONG_DOWNLOADED,
+                (file_path.as_posix(), 1, now, self._key(song_id)),
+            ).rowcount:
+                self.index.add(self.index.songs, song_id)
+            else:
+                self.cursor.execute(
+                    UPSERT_LIBRARY_FILE, (self._new_key(song_id), file_path.as_posix())
+                )
+                self.index.add(self.index.library, song_id)
+            stored += 1
         if should_commit:
-            self.connection.commit()
+            self._request_commit()
+        return stored
 
+    @writes
     def set_have_album_songs(
         self, album_id: SpotifyAlbumId, value: bool, should_commit: bool = False
     ):
         param = (
-            album_id,
+            self._new_key(album_id),
             int(value),
         )  # upsert, insert if none exists, overrite prior with new
-        self.cursor.execute(
-            """INSERT INTO fetched_songs 
-               VALUES (?, ?) ON CONFLICT (album_id) 
-               DO UPDATE SET have_fetched_all_songs_in_album=excluded.have_fetched_all_songs_in_album""",
-            param,
-        )
+        self.cursor.execute(UPSERT_HAVE_ALL_ALBUM_SONGS, param)
         if should_commit:
-            self.connection.commit()
+            self._request_commit()
 
+    @reads_own_writes
     def get_album_songs(self, album_id: SpotifyAlbumId) -> list[PackedSongs]:
         # you always get a tuple back, just need to index to the first value
 
         results = self.cursor.execute(
-            "SELECT song_id, album_id, artist_id, name, track_number, disc_number, quality_kbps FROM songs WHERE album_id = ?",
-            (album_id,),
+            SELECT_ALBUM_SONGS,
+            (self._key(album_id),),
         ).fetchall()
 
         packed_songs = []
@@ -325,9 +978,9 @@ class SQLiteDBManager:
         for result in results:
             packed_songs.append(
                 {
-                    "id": result[0],
-                    "album_id": result[1],
-                    "artist_id": result[2],
+                    "id": self._id(result[0]),
+                    "album_id": self._id(result[1]),
+                    "artist_id": self._id(result[2]),
                     "name": result[3],
                     "track_number": result[4],
                     "disc_number": result[5],
@@ -337,67 +990,211 @@ class SQLiteDBManager:
 
         return packed_songs
 
+    @writes
     def set_song_downloaded(
         self, song_id: SpotifySongId, file_path: Path, should_commit: bool = False
     ) -> None:
-        self.cursor.execute(
-            """UPDATE songs SET full_filepath = ?, download_completed = ?, timestamp_completed = ? WHERE song_id = ?""",
+        updated = self.cursor.execute(
+            UPDATE_SONG_DOWNLOADED,
             (
                 file_path.as_posix(),
                 1,
                 datetime.now().astimezone().isoformat(),
-                song_id,
+                self._key(song_id),
             ),
-        )
+        ).rowcount
+        # songs without a row (e.g. liked songs) are not recorded in the db either
+        if updated:
+            self.index.add(self.index.songs, song_id)
         if should_commit:
-            self.connection.commit()
+            self._request_commit()
 
     def have_song_downloaded(self, song_id: SpotifySongId) -> bool:
-        fetched = self.cursor.execute(
-            "SELECT download_completed FROM songs WHERE song_id = ?", (song_id,)
-        ).fetchone()
-        if fetched is None or fetched[0] == 0:
-            return False
-        else:
-            return True
+        return self.index.has(self.index.songs, song_id) or self.index.has(
+            self.index.library, song_id
+        )
 
+    @writes
     def upsert_credentials(
         self, username: str, credentials: str, type: str, should_commit: bool = False
     ) -> None:
-        self.cursor.execute(
-            """INSERT INTO credentials
-               VALUES (?, ?, ?, ?) ON CONFLICT (id) 
-               DO UPDATE SET username=excluded.username, credentials=excluded.credentials, type=excluded.type""",
-            (0, username, credentials, type),
-        )
+        self.cursor.execute(UPSERT_CREDENTIALS, (0, username, credentials, type))
+        # never batched, losing credentials means logging in again
         if should_commit:
-            self.connection.commit()
+            self._commit()
 
+    @reads
     def has_stored_credentials(self) -> bool:
         return self.get_credentials() is not None
 
+    @reads
     def get_credentials(self) -> Optional[Credentials]:
         return self.cursor.execute(
-            "SELECT username, credentials, type FROM credentials WHERE id = 0",
+            SELECT_CREDENTIALS,
         ).fetchone()
     
     def have_lyrics_downloaded(self, song_id: SpotifySongId) -> bool:
-        fetched = self.cursor.execute(
-            "SELECT lyrics_downloaded FROM songs WHERE song_id = ?", (song_id,)
-        ).fetchone()
-        if fetched is None or fetched[0] == 0:
-            return False
-        else:
-            return True
+        return self.index.has(self.index.lyrics, song_id)
 
+    @reads_own_writes
     def get_song_path(self, song_id: SpotifySongId) -> str:
-        return (self.cursor.execute("SELECT full_filepath FROM songs WHERE song_id = ?", (song_id,)).fetchone())[0]
+        fetched = self.cursor.execute(SELECT_SONG_PATH, (self._key(song_id),)).fetchone()
+        if fetched is None or fetched[0] is None:
+            fetched = self.cursor.execute(
+                SELECT_LIBRARY_FILE_PATH, (self._key(song_id),)
+            ).fetchone()
+        return fetched[0]
 
+    @writes
     def set_lyrics_downloaded(self, song_id: SpotifySongId, should_commit: bool = False) -> None:
+        song_key = self._key(song_id)
+        # scanned songs without a songs row keep the flag in library_files
+        if (
+            self.cursor.execute(UPDATE_LYRICS_DOWNLOADED, (1, song_key)).rowcount
+            or self.cursor.execute(UPDATE_LIBRARY_FILE_LYRICS, (1, song_key)).rowcount
+        ):
+            self.index.add(self.index.lyrics, song_id)
+        if should_commit:
+            self._request_commit()
+    @writes
+    def store_track_metadata(self, track: dict, should_commit: bool = False) -> None:
+        """Stores a track info dict as returned by RespotRequest.get_track_info"""
         self.cursor.execute(
-            """UPDATE songs SET lyrics_downloaded = ? WHERE song_id = ?""", (1, song_id))
+            UPSERT_ALBUM_METADATA,
+            (
+                self._new_key(track["album_id"]),
+                track["album_name"],
+                track["album_artist"],
+                track["release_date"],
+                track["image_url"],
+            ),
+        )
+        self.cursor.execute(
+            UPSERT_TRACK_METADATA,
+            (
+                self._new_key(track["id"]),
+                self._new_key(track["scraped_song_id"]),
+                self._new_key(track["album_id"]),
+                self._new_key(track["artist_id"]),
+                track["artist_name"],
+                track["audio_name"],
+                track["disc_number"],
+                track["audio_number"],
+                int(track["is_playable"]),
+            ),
+        )
         if should_commit:
-            self.connection.commit()
+            self._request_commit()
+
+    @reads
+    def get_track_metadata(self, song_id: SpotifySongId) -> Optional[dict]:
+        """Returns the same dict shape as RespotRequest.get_track_info, None if not stored"""
+        result = self.cursor.execute(
+            SELECT_TRACK_METADATA,
+            (self._key(song_id),),
+        ).fetchone()
+
+        if result is None:
+            return None
+
+        return {
+            "id": song_id,
+            "scraped_song_id": self._id(result[0]),
+            "album_id": self._id(result[1]),
+            "artist_id": self._id(result[2]),
+            "artist_name": result[3],
+            "audio_name": result[4],
+            "disc_number": result[5],
+            "audio_number": result[6],
+            "is_playable": bool(result[7]),
+            "album_name": result[8],
+            "album_artist": result[9],
+            "release_date": result[10],
+            "release_year": result[10].split("-")[0],
+            "image_url": result[11],
+        }
+
+    @reads
+    def have_track_metadata(self, song_id: SpotifySongId) -> bool:
+        fetched = self.cursor.execute(
+            SELECT_HAVE_TRACK_METADATA, (self._key(song_id),)
+        ).fetchone()
+        return fetched is not None
+
+    @reads
+    def get_playlist_snapshot(self, playlist_id: str) -> Optional[str]:
+        """snapshot_id the stored playlist artists were read at, None if never stored"""
+        fetched = self.cursor.execute(
+            SELECT_PLAYLIST_SNAPSHOT, (self._key(playlist_id),)
+        ).fetchone()
+        return None if fetched is None else fetched[0]
+
+    @reads_own_writes
+    def get_playlist_artists(self, playlist_id: str) -> PackedArtists:
+        result = self.cursor.execute(
+            SELECT_PLAYLIST_ARTISTS, (self._key(playlist_id),)
+        ).fetchall()
+        return sorted((self._id(artist_id), name) for artist_id, name in result)
+
+    @writes
+    def store_playlist_artists(
+        self,
+        playlist_id: str,
+        snapshot: str,
+        packed_artists: PackedArtists,
+        should_commit: bool = False,
+    ) -> None:
+        """Replaces the playlist's stored artists with the ones read at snapshot"""
+        playlist_key = self._new_key(playlist_id)
+        self.cursor.execute(UPSERT_PLAYLIST, (playlist_key, snapshot))
+        self.cursor.execute(DELETE_PLAYLIST_ARTISTS, (playlist_key,))
+        self.cursor.executemany(
+            INSERT_PLAYLIST_ARTIST,
+            [
+                (playlist_key, self._new_key(artist_id), name)
+                for artist_id, name in packed_artists
+            ],
+        )
+        if should_commit:
+            self._request_commit()
+
+    @reads
+    def get_songs_missing_lyrics(self) -> list[tuple[SpotifySongId, str]]:
+        return [
+            (self._id(song_id), full_filepath)
+            for song_id, full_filepath in self.cursor.execute(SELECT_SONGS_MISSING_LYRICS)
+        ]
+
+    @reads
+    def get_downloaded_song_paths(self) -> list[tuple[SpotifySongId, str]]:
+        return [
+            (self._id(song_id), full_filepath)
+            for song_id, full_filepath in self.cursor.execute(SELECT_DOWNLOADED_SONG_PATHS)
+        ]
+
+    @reads
+    def query_plan(self, query: str) -> list[str]:
+        """Detail lines of EXPLAIN QUERY PLAN for query"""
+        params = (None,) * query.count("?")
+        return [
+            row[3]
+            for row in self.cursor.execute(f"EXPLAIN QUERY PLAN {query}", params)
+        ]
+
+    def find_table_scans(self) -> list[str]:
+        """Returns the QUERIES outside FULL_SCAN_QUERIES whose query plan reads a whole table"""
+        # detail reads "SCAN <table>" unless an index is used
+        return [
+            " ".join(query.split())
+            for query in QUERIES
+            if query not in FULL_SCAN_QUERIES
+            and any(
+                detail.startswith("SCAN") and "INDEX" not in detail
+                for detail in self.query_plan(query)
+            )
+        ]
+
+    @reads
     def get_db_version(self) -> int:
         return (self.cursor.execute("PRAGMA user_version").fetchone())[0]
     def migration_0(self):
@@ -423,6 +1220,102 @@ class SQLiteDBManager:
 
         self.connection.execute(f"PRAGMA user_version = {version + 1}")
 
+    def migration_2(self):
+        version = self.get_db_version()
+
+        if version >= 2:
+            return
+
+        # add changes here
+        # cache full track and album metadata for tagging, not present in versions < 2
+        self.cursor.execute(CREATE_ALBUM_METADATA_TABLE)
+        self.cursor.execute(CREATE_TRACK_METADATA_TABLE)
+        # end changes
+
+        self.connection.execute(f"PRAGMA user_version = {version + 1}")
+
+    def migration_3(self):
+        version = self.get_db_version()
+
+        if version >= 3:
+            return
+
+        # add changes here
+        # secondary indexes for the hot lookups, not present in versions < 3
+        for create_index in CREATE_INDEXES:
+            self.cursor.execute(create_index)
+        # end changes
+
+        self.connection.execute(f"PRAGMA user_version = {version + 1}")
+
+    def migration_4(self):
+        version = self.get_db_version()
+
+        if version >= 4:
+            return
+
+        # add changes here
+        # id storage mode and the id mapping for compact storage, not present in versions < 4
+        self.cursor.execute(CREATE_SPOTIFY_IDS_TABLE)
+        self.cursor.execute(CREATE_ID_STORAGE_TABLE)
+        self.cursor.execute(INSERT_ID_STORAGE, ("text",))
+        # end changes
+
+        self.connection.execute(f"PRAGMA user_version = {version + 1}")
+
+    def migration_5(self):
+        version = self.get_db_version()
+
+        if version >= 5:
+            return
+
+        # add changes here
+        # watermark for incremental liked artist queries, not present in versions < 5
+        self.cursor.execute("ALTER TABLE fetched_artists ADD liked_added_at TEXT DEFAULT NULL")
+        # end changes
+
+        self.connection.execute(f"PRAGMA user_version = {version + 1}")
+
+    def migration_6(self):
+        version = self.get_db_version()
+
+        if version >= 6:
+            return
+
+        # add changes here
+        # per artist age of the album listing, not present in versions < 6.
+        # TEXT and not TIMESTAMP, sqlite3's timestamp converter can't parse isoformat()
+        self.cursor.execute("ALTER TABLE fetched_albums ADD last_checked TEXT DEFAULT NULL")
+        # end changes
+
+        self.connection.execute(f"PRAGMA user_version = {version + 1}")
+
+    def migration_7(self):
+        version = self.get_db_version()
+
+        if version >= 7:
+            return
+
+        # add changes here
+        # playlist artists cached by snapshot_id, not present in versions < 7
+        self.cursor.execute(CREATE_PLAYLISTS_TABLE)
+        self.cursor.execute(CREATE_PLAYLIST_ARTISTS_TABLE)
+        # end changes
+
+        self.connection.execute(f"PRAGMA user_version = {version + 1}")
+
+    def migration_8(self):
+        version = self.get_db_version()
+
+        if version >= 8:
+            return
+
+        # add changes here
+        # songs found by --scan-library, not present in versions < 8
+        self.cursor.execute(CREATE_LIBRARY_FILES_TABLE)
+        # end changes
+
+        self.connection.execute(f"PRAGMA user_version = {version + 1}")
 
 
 db_manager = SQLiteDBManager()
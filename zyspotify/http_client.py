@@ -0,0 +1,33 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+# api.spotify.com, spclient and the image cdn, plus a little headroom
+DEFAULT_POOL_HOSTS = 8
+DEFAULT_POOL_SIZE = 10
+
+
+class HTTPClient:
+    """Shared session so api, lyrics and cover art requests reuse keep-alive connections per host"""
+
+    def __init__(self) -> None:
+        self.configure()
+
+    def configure(
+        self, pool_size: int = DEFAULT_POOL_SIZE, pool_hosts: int = DEFAULT_POOL_HOSTS
+    ) -> None:
+        """pool_size connections are kept alive per host, for up to pool_hosts hosts"""
+        adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size)
+
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        self.session = session
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.session.get(url, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+http_client = HTTPClient()
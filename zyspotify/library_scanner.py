@@ -0,0 +1,87 @@
+import logging
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Optional
+
+import music_tag
+from mutagen import MutagenError, id3
+
+from .custom_types import *
+
+logger = logging.getLogger()
+
+# reading tags is small random reads, worth more threads than cores
+DEFAULT_SCAN_WORKERS = 16
+AUDIO_EXTENSIONS = (".mp3", ".ogg", ".m4a", ".flac")
+# written to the comment tag by AudioTagger
+TRACK_URL = re.compile(r"open\.spotify\.com/track/([0-9A-Za-z]{22})")
+
+
+def read_track_id(path: Path) -> Optional[SpotifySongId]:
+    """Spotify id from the file's comment tag, None if it has none"""
+    try:
+        if path.suffix == ".mp3":
+            comments = [
+                str(text)
+                for frame in id3.ID3(path).getall("COMM")
+                for text in frame.text
+            ]
+        else:
+            comments = [str(music_tag.load_file(path)["comment"])]
+    except (MutagenError, OSError, ValueError) as e:
+        logger.warning(f"Could not read tags of {path}: {e}")
+        return None
+
+    for comment in comments:
+        if match := TRACK_URL.search(comment):
+            return match.group(1)
+    return None
+
+
+def list_directory(directory: Path) -> tuple[list[Path], list[Path]]:
+    """Audio files and subdirectories of directory"""
+    files, subdirectories = [], []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(Path(entry.path))
+                elif entry.name.endswith(AUDIO_EXTENSIONS):
+                    path = Path(entry.path)
+                    # unfinished downloads are named <stem>.part.<ext>
+                    if not path.stem.endswith(".part"):
+                        files.append(path)
+    except OSError as e:
+        logger.warning(f"Could not list {directory}: {e}")
+    return files, subdirectories
+
+
+def scan_library(
+    music_dir: Path, workers: int = DEFAULT_SCAN_WORKERS
+) -> list[tuple[SpotifySongId, Path]]:
+    """Finds the songs under music_dir by the track url in their tags.
+
+    Directories are listed and files read on the pool at the same time, each
+    listed directory queues its subdirectories and its files.
+    """
+    found = []
+    with ThreadPoolExecutor(
+        max_workers=max(1, workers), thread_name_prefix="scan"
+    ) as pool:
+        listings = {pool.submit(list_directory, music_dir)}
+        reads = []
+        while listings:
+            done, listings = wait(listings, return_when=FIRST_COMPLETED)
+            for listing in done:
+                files, subdirectories = listing.result()
+                listings.update(pool.submit(list_directory, d) for d in subdirectories)
+                reads.extend((path, pool.submit(read_track_id, path)) for path in files)
+
+        for path, read in reads:
+            if (track_id := read.result()) is not None:
+                found.append((track_id, path))
+
+    logger.info(f"Found {len(found)} songs in {len(reads)} files under {music_dir}")
+    return found
@@ -0,0 +1,42 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+logger = logging.getLogger()
+
+
+class RefreshPolicy:
+    """Decides which cached listings are old enough to be queried again.
+
+    A listing goes stale ttl_days after it was last checked. At most budget
+    stale listings are refreshed per run, the rest wait for a later run so
+    the load is spread out instead of re-crawling everything at once.
+    """
+
+    def __init__(self, ttl_days: Optional[float] = None, budget: Optional[int] = None):
+        self.ttl = None if ttl_days is None else timedelta(days=ttl_days)
+        self.budget = budget
+        self.lock = threading.Lock()
+
+    def is_stale(self, last_checked: Optional[str]) -> bool:
+        if self.ttl is None:
+            return False
+        # listings fetched before last_checked was recorded
+        if last_checked is None:
+            return True
+        return datetime.now().astimezone() - datetime.fromisoformat(last_checked) >= self.ttl
+
+    def claim(self, last_checked: Optional[str]) -> bool:
+        """True if the listing is stale and still fits in this run's budget"""
+        if not self.is_stale(last_checked):
+            return False
+
+        with self.lock:
+            if self.budget is None:
+                return True
+            if self.budget <= 0:
+                logger.debug("Refresh budget used up, stale listing kept until a later run")
+                return False
+            self.budget -= 1
+            return True
@@ -0,0 +1,204 @@
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+logger = logging.getLogger()
+
+DEFAULT_CACHE_SIZE_MB = 64
+
+# api paths worth caching and how long a response is used without asking spotify.
+# once expired it is revalidated with If-None-Match, unchanged resources cost a 304
+CACHE_TTLS = [
+    (re.compile(r"^/v1/artists/[^/]+$"), 7 * 24 * 3600),
+    (re.compile(r"^/v1/albums/[^/]+$"), 30 * 24 * 3600),
+    (re.compile(r"^/v1/shows/[^/]+$"), 24 * 3600),
+    # snapshot_id has to be current, always revalidated
+    (re.compile(r"^/v1/playlists/[^/]+$"), 0),
+]
+
+CREATE_RESPONSES_TABLE = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT NOT NULL PRIMARY KEY,
+    etag TEXT DEFAULT NULL,
+    last_modified TEXT DEFAULT NULL,
+    content_type TEXT DEFAULT NULL,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+"""
+
+CREATE_RESPONSES_LRU_INDEX = (
+    "CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_used)"
+)
+
+
+class CachedResponse:
+    def __init__(self, key, etag, last_modified, content_type, body, expires_at):
+        self.key = key
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_type = content_type
+        self.body = body
+        self.expires_at = expires_at
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+    def validators(self) -> dict:
+        """Conditional request headers, the server answers 304 if the resource is unchanged"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def to_response(self, url: str) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.encoding = "utf-8"
+        response._content = zlib.decompress(self.body)
+        response.headers = CaseInsensitiveDict(
+            {"content-type": self.content_type} if self.content_type else {}
+        )
+        return response
+
+
+class ResponseCache:
+    """Persistent cache of api responses in its own sqlite file.
+
+    Bodies are stored zlib compressed. Once the stored bytes exceed max_bytes
+    the least recently used responses are evicted. Disabled until opened.
+    """
+
+    def __init__(self) -> None:
+        self.connection: Optional[sqlite3.Connection] = None
+        self.max_bytes = 0
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def open(self, cache_path: Path, max_bytes: int) -> None:
+        if max_bytes <= 0:
+            return
+
+        self.max_bytes = max_bytes
+        # autocommit, every entry is written on its own and lost ones are only refetched
+        self.connection = sqlite3.connect(
+            cache_path, check_same_thread=False, isolation_level=None
+        )
+        self.connection.execute(CREATE_RESPONSES_TABLE)
+        self.connection.execute(CREATE_RESPONSES_LRU_INDEX)
+        self.total_bytes = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+        self._evict()
+
+    def close(self) -> None:
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    @staticmethod
+    def ttl_for(url: str) -> Optional[int]:
+        """None if responses of url are not cached"""
+        path = urlsplit(url).path
+        for pattern, ttl in CACHE_TTLS:
+            if pattern.match(path):
+                return ttl
+        return None
+
+    @staticmethod
+    def make_key(url: str, params: Optional[dict]) -> str:
+        return url if not params else f"{url} {json.dumps(params, sort_keys=True)}"
+
+    def lookup(self, url: str, params: Optional[dict] = None) -> Optional[CachedResponse]:
+        if self.connection is None or self.ttl_for(url) is None:
+            return None
+
+        key = self.make_key(url, params)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT etag, last_modified, content_type, body, expires_at FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+        return CachedResponse(key, *row)
+
+    def store(
+        self, url: str, params: Optional[dict], response: requests.Response
+    ) -> None:
+        if self.connection is None or (ttl := self.ttl_for(url)) is None:
+            return
+        # without a validator a stale entry could never be revalidated
+        if ttl == 0 and not response.headers.get("ETag"):
+            return
+
+        body = zlib.compress(response.content)
+        now = time.time()
+        with self.lock:
+            previous = self.connection.execute(
+                "SELECT size FROM responses WHERE key = ?",
+                (self.make_key(url, params),),
+            ).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.make_key(url, params),
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                    response.headers.get("content-type"),
+                    body,
+                    len(body),
+                    now + ttl,
+                    now,
+                ),
+            )
+            self.total_bytes += len(body) - (previous[0] if previous else 0)
+            self._evict()
+
+    def revalidated(self, cached: CachedResponse, url: str) -> None:
+        """The server confirmed cached is unchanged, use it for another ttl"""
+        if self.connection is None:
+            return
+
+        with self.lock:
+            self.connection.execute(
+                "UPDATE responses SET expires_at = ? WHERE key = ?",
+                (time.time() + self.ttl_for(url), cached.key),
+            )
+
+    def _evict(self) -> None:
+        while self.total_bytes > self.max_bytes:
+            oldest = self.connection.execute(
+                "SELECT key, size FROM responses ORDER BY last_used LIMIT 64"
+            ).fetchall()
+            if not oldest:
+                self.total_bytes = 0
+                return
+
+            for key, size in oldest:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.total_bytes -= size
+                if self.total_bytes <= self.max_bytes:
+                    return
+
+
+response_cache = ResponseCache()
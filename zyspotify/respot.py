@@ -1,18 +1,31 @@
 from io import BytesIO
 from pathlib import Path
 import json
+import os
 import re
 import requests
-import time
-from typing import List, Optional
+import threading
+from typing import BinaryIO, List, Optional
 from .db import db_manager
+from .http_client import http_client
+from .retry import retry_policy
+from .refresh import RefreshPolicy
+from .response_cache import response_cache
+from .scheduler import request_scheduler
 from .utils import FormatUtils
 from .custom_types import *
+from .transcoder import (
+    NO_TRANSCODER_ERROR,
+    TranscodePool,
+    finish_part,
+    get_transcoder,
+    part_path_for,
+)
+from concurrent.futures import Future, ThreadPoolExecutor
 import tempfile
 from librespot.audio.decoders import AudioQuality, VorbisOnlyAudioQuality
 from librespot.core import ApiClient, Session
 from librespot.metadata import TrackId, EpisodeId
-from pydub import AudioSegment
 from tqdm import tqdm
 import logging
 import math
@@ -24,9 +37,16 @@ def removeDuplicates(lst):
     return [t for t in (set(tuple(i) for i in lst))]
 
 
-MAX_AUTH_GET_RETRIES = 10
 AUTH_GET_TIMEOUT = 10
-AUTH_GET_RETRY_MULTIPLE_SEC = 10
+
+# limit of the several tracks endpoint
+MAX_TRACK_IDS_PER_REQUEST = 50
+
+# limit of the several albums endpoint
+MAX_ALBUM_IDS_PER_REQUEST = 20
+
+# pages of a paged endpoint requested at once, shared by all workers
+MAX_PAGE_REQUESTS_IN_FLIGHT = 4
 
 SPOTIFY_API = "https://api.spotify.com/v1"
 
@@ -39,12 +59,34 @@ LYRIC_API = "https://spclient.wg.spotify.com/color-lyrics/v2/track"
 
 class Respot:
     def __init__(
-        self, config_dir, force_premium, cli_args, audio_format, antiban_wait_time
+        self,
+        config_dir,
+        force_premium,
+        cli_args,
+        audio_format,
+        antiban_wait_time,
+        stream_to_disk=False,
+        transcoder="ffmpeg",
+        transcode_workers=0,
     ):
         self.config_dir: Path = config_dir
         self.force_premium: bool = force_premium
         self.audio_format: str = audio_format
         self.antiban_wait_time: int = antiban_wait_time
+        request_scheduler.set_spacing("track", antiban_wait_time)
+        self.stream_to_disk: bool = stream_to_disk
+        try:
+            self.transcoder = get_transcoder(transcoder)
+        except RuntimeError:
+            # songs stream as ogg vorbis, only other formats need a converter for every track
+            if audio_format not in ("source", "ogg"):
+                raise
+            self.transcoder = None
+        self.transcode_pool: Optional[TranscodePool] = (
+            TranscodePool(transcoder, transcode_workers)
+            if transcode_workers > 0 and self.transcoder is not None
+            else None
+        )
         self.auth: RespotAuth = RespotAuth(self.force_premium, cli_args)
         self.request: RespotRequest = None
 
@@ -54,13 +96,26 @@ class Respot:
             return True
         return False
 
-    def download(self, track_id, temp_path: Path, extension, make_dirs=True) -> str:
+    def download(
+        self, track_id, temp_path: Path, extension, make_dirs=True, tag=None
+    ) -> str | Path | Future:
+        """Returns the output path, or a Future of it when conversion runs on the transcode pool.
+
+        tag is called with the complete temp file before it moves in place. On the transcode
+        pool the Future then resolves to (temp file, output path), to be tagged and moved with finish_part.
+        """
         handler = RespotTrackHandler(
-            self.auth, self.audio_format, self.antiban_wait_time, self.auth.quality
+            self.auth,
+            self.audio_format,
+            self.auth.quality,
+            self.transcoder,
         )
         if make_dirs:
             handler.create_out_dirs(temp_path.parent)
 
+        if self.stream_to_disk:
+            return self._download_to_disk(handler, track_id, temp_path, extension, tag)
+
         # Download the audio
         filename = temp_path.stem
         audio_bytes = handler.download_audio(track_id, filename)
@@ -76,17 +131,73 @@ class Respot:
 
         if extension == audio_bytes_format:
             logger.info(f"Saving {output_path.stem} directly")
-            handler.bytes_to_file(audio_bytes, output_path)
+            handler.bytes_to_file(audio_bytes, part_path_for(output_path))
+            finish_part(part_path_for(output_path), output_path, tag)
         elif extension == "source":
             output_str = filename + "." + audio_bytes_format
             output_path = temp_path.parent / output_str
             logger.info(f"Saving {filename} as {extension}")
-            handler.bytes_to_file(audio_bytes, output_path)
+            handler.bytes_to_file(audio_bytes, part_path_for(output_path))
+            finish_part(part_path_for(output_path), output_path, tag)
         else:
             output_str = filename + "." + extension
             output_path = temp_path.parent / output_str
+
+            if self.transcode_pool is not None:
+                # workers read from disk, the buffer is released once written
+                part_path = temp_path.parent / (filename + ".part")
+                handler.bytes_to_file(audio_bytes, part_path)
+                return self._queue_conversion(handler, part_path, output_path, tag)
+
             logger.info(f"Converting {filename} to {extension}")
-            handler.convert_audio_format(audio_bytes, output_path)
+            handler.convert_audio_format(audio_bytes, output_path, tag)
+
+        return output_path
+
+    def _queue_conversion(
+        self, handler: "RespotTrackHandler", part_path: Path, output_path: Path, tag
+    ) -> Future:
+        logger.info(f"Queueing {output_path.stem} for conversion to {handler.format}")
+        # taggers can't cross into the pool process, the temp file comes back to be tagged
+        return self.transcode_pool.submit(
+            part_path,
+            output_path,
+            handler.format,
+            handler.get_bitrate(),
+            keep_part=tag is not None,
+        )
+
+    def _download_to_disk(
+        self, handler: "RespotTrackHandler", track_id, temp_path: Path, extension, tag
+    ) -> str | Path | Future:
+        """Same as download, but the audio never lives in memory as a whole"""
+        filename = temp_path.stem
+        part_path = temp_path.parent / (filename + ".part")
+
+        if handler.download_audio_to_file(track_id, part_path) is None:
+            part_path.unlink(missing_ok=True)
+            return ""
+
+        with open(part_path, "rb") as audio_file:
+            audio_file_format = handler.determine_file_extension(audio_file)
+
+        if extension == audio_file_format or extension == "source":
+            output_path = temp_path.parent / (filename + "." + audio_file_format)
+            logger.info(f"Saving {filename} as {audio_file_format}")
+            # renamed so the tagger can tell the format from the extension
+            os.replace(part_path, part_path_for(output_path))
+            finish_part(part_path_for(output_path), output_path, tag)
+        else:
+            output_path = temp_path.parent / (filename + "." + extension)
+
+            if self.transcode_pool is not None:
+                return self._queue_conversion(handler, part_path, output_path, tag)
+
+            logger.info(f"Converting {filename} to {extension}")
+            try:
+                handler.convert_audio_format(part_path, output_path, tag)
+            finally:
+                part_path.unlink(missing_ok=True)
 
         return output_path
 
@@ -95,7 +206,11 @@ class RespotAuth:
     def __init__(self, force_premium, cli_args):
         self.force_premium = force_premium
         self.force_liked_artist_query = cli_args.force_liked_artist_query
+        self.sync_liked_artist_query = cli_args.sync_liked_artist_query
         self.force_album_query = cli_args.force_album_query
+        self.album_refresh = RefreshPolicy(
+            cli_args.album_query_ttl_days, cli_args.album_query_budget
+        )
         self.session = None
         self.token = None
         self.token_your_library = None
@@ -182,198 +297,235 @@ class RespotRequest:
         self.auth = auth
         self.token = auth.token
         self.token_your_library = auth.token_your_library
+        self.track_info_cache: dict[SpotifySongId, dict] = {}
+        self.album_info_cache: dict[SpotifyAlbumId, dict] = {}
+        self.token_lock = threading.Lock()
+        self.page_pool = ThreadPoolExecutor(
+            max_workers=MAX_PAGE_REQUESTS_IN_FLIGHT, thread_name_prefix="page"
+        )
 
     def authorized_get_request(
-        self, url: str, retry_count: int = 0, add_header: dict = {}, **kwargs
+        self, url: str, add_header: dict = {}, **kwargs
     ) -> Optional[requests.Response]:
-        if retry_count > MAX_AUTH_GET_RETRIES:
-            logger.critical(
-                f"Max authorized_get_request retries ({MAX_AUTH_GET_RETRIES}) reached."
-            )
-            raise RuntimeError("Connection Error: Too many retries")
+        attempt = 0
 
-        def retry():
-            time.sleep(retry_count * AUTH_GET_RETRY_MULTIPLE_SEC)
-            return self.authorized_get_request(
-                url, retry_count + 1, **kwargs, add_header=add_header
-            )
+        cached = response_cache.lookup(url, kwargs.get("params"))
+        if cached is not None and cached.is_fresh():
+            return cached.to_response(url)
 
-        try:
-
-            headers = {
-                "Authorization": f"Bearer {self.token_your_library if url.startswith(API_ME) or url.startswith(LYRIC_API) else self.token}"
-            }
-            headers.update(add_header)
+        while True:
+            retry_policy.wait_for_pause()
 
-            response = requests.get(
-                url,
-                headers=headers,
-                **kwargs,
-                timeout=AUTH_GET_TIMEOUT,
+            response = None
+            token = (
+                self.token_your_library
+                if url.startswith(API_ME) or url.startswith(LYRIC_API)
+                else self.token
             )
 
-            response.raise_for_status()
+            try:
+                headers = {"Authorization": f"Bearer {token}"}
+                if cached is not None:
+                    headers.update(cached.validators())
+                headers.update(add_header)
+
+                response = http_client.get(
+                    url,
+                    headers=headers,
+                    **kwargs,
+                    timeout=AUTH_GET_TIMEOUT,
+                )
+
+                response.raise_for_status()
 
-            if response.status_code == 204:
-                logger.error("authorized_get_request http 204 No Content")
-                retry()
+                if response.status_code == 304 and cached is not None:
+                    # unchanged since it was cached, no body was sent
+                    response_cache.revalidated(cached, url)
+                    return cached.to_response(url)
 
-            # if headers indicated response contained json, verify it decodes fine.
-            if response.status_code != 204 and response.headers[
-                "content-type"
-            ].strip().startswith("application/json"):
-                json_resp = response.json()
+                elif response.status_code == 204:
+                    logger.error("authorized_get_request http 204 No Content")
 
-                empty = not bool(json_resp)
-                if json_resp == None or empty:
+                # if headers indicated response contained json, verify it decodes fine.
+                elif response.headers.get("content-type", "").strip().startswith(
+                    "application/json"
+                ) and not response.json():
                     logger.error(f"authorized_get_request json response was empty")
-                    retry()
-            elif response is None:
-                retry()
 
-            # typical, errorless case
-            return response
+                else:
+                    # typical, errorless case
+                    response_cache.store(url, kwargs.get("params"), response)
+                    return response
 
-        except requests.exceptions.ConnectionError as e:
-            logger.error(
-                f"authorized_get_request ConnectionError: {'response had type none' if e.response is None else e.response.text}",
-                exc_info=e,
-            )
-            retry()
+            except requests.exceptions.HTTPError as e:
+                if not retry_policy.should_retry(response):
+                    return response
 
-        except requests.exceptions.HTTPError as e:
-            if response.status_code == 401:
-                logger.warning("Token expired, refreshing...")
-                self.token, self.token_your_library = self.auth.refresh_token()
-                
-            elif response.status_code == 404:
-                return response
-            else:
+                if response.status_code == 401:
+                    logger.warning("Token expired, refreshing...")
+                    self.refresh_token(token)
+                else:
+                    logger.error(
+                        f"authorized_get_request HTTPError: {'response had type none' if e.response is None else e.response.text}",
+                        exc_info=e,
+                    )
+
+            # ConnectionError, Timeout, JSONDecodeError and the rest
+            except requests.exceptions.RequestException as e:
                 logger.error(
-                    f"authorized_get_request HTTPError: {'response had type none' if e.response is None else e.response.text}",
+                    f"authorized_get_request {type(e).__name__}: {'response had type none' if e.response is None else e.response.text}",
                     exc_info=e,
                 )
 
-            retry()
+            attempt += 1
+            retry_policy.backoff(attempt, response)
 
-        except requests.exceptions.Timeout as e:
-            logger.error(
-                f"authorized_get_request Timeout: {'response had type none' if e.response is None else e.response.text}",
-                exc_info=e,
-            )
-            retry()
+    def get_all_items(self, url: str, limit: int, params: dict = {}) -> list[dict]:
+        """Returns the items of every page of a paged endpoint, in order.
 
-        except requests.exceptions.JSONDecodeError as e:
-            logger.error(
-                f"authorized_get_request JSONDecodeError: {'response had type none' if e.response is None else e.response.text}",
-                exc_info=e,
-            )
-            retry()
+        The first page tells the total, the remaining pages are then requested
+        concurrently through page_pool. Rate limited responses pause every
+        request through retry_policy like any other.
+        """
+        first_page = self.authorized_get_request(
+            url, params={**params, "limit": limit, "offset": 0}
+        ).json()
+        items = first_page["items"]
 
-        except requests.exceptions.RequestException as e:
-            logger.error(
-                f"authorized_get_request RequestException: {'response had type none' if e.response is None else e.response.text}",
-                exc_info=e,
-            )
-            retry()
+        def get_page(offset: int) -> list[dict]:
+            return self.authorized_get_request(
+                url, params={**params, "limit": limit, "offset": offset}
+            ).json()["items"]
+
+        # map hands the pages back in offset order however they complete
+        for page in self.page_pool.map(get_page, range(limit, first_page["total"], limit)):
+            items.extend(page)
+        return items
+
+    def refresh_token(self, stale_token: str) -> None:
+        # several workers can see the same 401, only the first one refreshes
+        with self.token_lock:
+            if stale_token in (self.token, self.token_your_library):
+                self.token, self.token_your_library = self.auth.refresh_token()
 
     def get_track_info(self, track_id) -> Optional[dict]:
         """Retrieves metadata for downloaded songs"""
-        info_request = self.authorized_get_request(
-            "https://api.spotify.com/v1/tracks?ids=" + track_id + "&market=from_token"
-        )
-        if info_request is None:
-            return None
+        # prefetched by album and liked songs flows, only used once so drop it
+        if (info := self.track_info_cache.pop(track_id, None)) is not None:
+            return info
+
+        # availability can change, only trust the db for playable songs
+        info = db_manager.get_track_metadata(track_id)
+        if info is not None and info["is_playable"]:
+            return info
+
+        return self.get_tracks_info([track_id]).get(track_id)
+
+    def get_tracks_info(self, track_ids: list[SpotifySongId]) -> dict[SpotifySongId, dict]:
+        """Retrieves metadata for many songs, MAX_TRACK_IDS_PER_REQUEST per request"""
+        infos = {}
+
+        for i in range(0, len(track_ids), MAX_TRACK_IDS_PER_REQUEST):
+            ids = track_ids[i : i + MAX_TRACK_IDS_PER_REQUEST]
+            info_request = self.authorized_get_request(
+                f"{SPOTIFY_API}/tracks",
+                params={"ids": ",".join(ids), "market": "from_token"},
+            )
+            if info_request is None:
+                continue
+
+            # tracks come back in the order requested, unknown ids as null
+            for track_id, track in zip(ids, info_request.json()["tracks"]):
+                if track is not None:
+                    infos[track_id] = self.parse_track_info(track_id, track)
+                    db_manager.store_track_metadata(infos[track_id])
+
+            db_manager.request_commit()
+
+        return infos
+
+    def prefetch_tracks_info(self, track_ids: list[SpotifySongId]) -> list[SpotifySongId]:
+        """Resolves metadata for the songs of a batch still to be downloaded ahead of
+        get_track_info, returns the ids to hand to release_tracks_info after the batch
+        """
+        missing = [
+            track_id
+            for track_id in track_ids
+            if not db_manager.have_song_downloaded(track_id)
+            and track_id not in self.track_info_cache
+            and not db_manager.have_track_metadata(track_id)
+        ]
+        self.track_info_cache.update(self.get_tracks_info(missing))
+        return missing
+
+    def release_tracks_info(self, track_ids: list[SpotifySongId]) -> None:
+        """Drops what a batch left in the cache, songs skipped or failed before get_track_info"""
+        for track_id in track_ids:
+            self.track_info_cache.pop(track_id, None)
 
+    @staticmethod
+    def parse_track_info(track_id, track: dict) -> dict:
         # Sum the size of the images, compares and saves the index of the
         # largest image size
-        info = info_request.json()
-
         sum_total = []
-        for sum_px in info["tracks"][0]["album"]["images"]:
+        for sum_px in track["album"]["images"]:
             sum_total.append(sum_px["height"] + sum_px["width"])
 
         img_index = sum_total.index(max(sum_total)) if sum_total else -1
 
-        artist_id = info["tracks"][0]["artists"][0]["id"]
+        artist_id = track["artists"][0]["id"]
 
-        artists = [data["name"] for data in info["tracks"][0]["artists"]]
+        artists = [data["name"] for data in track["artists"]]
 
         # TODO: Implement genre checking
         return {
             "id": track_id,
             "artist_id": artist_id,
             "artist_name": RespotUtils.conv_artist_format(artists),
-            "album_artist": info["tracks"][0]["album"]["artists"][0]["name"],
-            "album_name": info["tracks"][0]["album"]["name"],
-            "audio_name": info["tracks"][0]["name"],
+            "album_id": track["album"]["id"],
+            "album_artist": track["album"]["artists"][0]["name"],
+            "album_name": track["album"]["name"],
+            "audio_name": track["name"],
             "image_url": (
-                info["tracks"][0]["album"]["images"][img_index]["url"]
-                if img_index >= 0
-                else None
+                track["album"]["images"][img_index]["url"] if img_index >= 0 else None
             ),
-            "release_year": info["tracks"][0]["album"]["release_date"].split("-")[0],
-            "disc_number": info["tracks"][0]["disc_number"],
-            "audio_number": info["tracks"][0]["track_number"],
-            "scraped_song_id": info["tracks"][0]["id"],
-            "is_playable": info["tracks"][0]["is_playable"],
-            "release_date": info["tracks"][0]["album"]["release_date"],
+            "release_year": track["album"]["release_date"].split("-")[0],
+            "disc_number": track["disc_number"],
+            "audio_number": track["track_number"],
+            "scraped_song_id": track["id"],
+            "is_playable": track["is_playable"],
+            "release_date": track["album"]["release_date"],
         }
 
     def get_all_user_playlists(self):
         """Returns list of users playlists"""
-        playlists = []
-        limit = 50
-        offset = 0
-
-        while True:
-            resp = self.authorized_get_request(
-                API_ME + "playlists",
-                params={"limit": limit, "offset": offset},
-            ).json()
-            offset += limit
-            playlists.extend(resp["items"])
-
-            if len(resp["items"]) < limit:
-                break
-
-        return {"playlists": playlists}
+        return {"playlists": self.get_all_items(f"{API_ME}/playlists", limit=50)}
 
     def get_playlist_songs(self, playlist_id):
         """returns list of songs in a playlist"""
-        offset = 0
-        limit = 100
         audios = []
 
-        while True:
-            resp = self.authorized_get_request(
-                f"{API_PLAYLIST}/{playlist_id}/tracks",
-                params={"limit": limit, "offset": offset},
-            ).json()
-            offset += limit
-            for song in resp["items"]:
-                if song["track"] is not None:
-                    audios.append(
-                        {
-                            "id": song["track"]["id"],
-                            "name": song["track"]["name"],
-                            "artist": song["track"]["artists"][0]["name"],
-                        }
-                    )
-
-            if len(resp["items"]) < limit:
-                break
+        for song in self.get_all_items(f"{API_PLAYLIST}/{playlist_id}/tracks", limit=100):
+            if song["track"] is not None:
+                audios.append(
+                    {
+                        "id": song["track"]["id"],
+                        "name": song["track"]["name"],
+                        "artist": song["track"]["artists"][0]["name"],
+                    }
+                )
         return audios
 
     def get_playlist_info(self, playlist_id):
         """Returns information scraped from playlist"""
         resp = self.authorized_get_request(
-            f"{API_PLAYLIST}/{playlist_id}?fields=name,owner(display_name)&market=from_token"
+            f"{API_PLAYLIST}/{playlist_id}?fields=name,owner(display_name),snapshot_id&market=from_token"
         ).json()
         return {
             "name": resp["name"].strip(),
             "owner": resp["owner"]["display_name"].strip(),
             "id": playlist_id,
+            "snapshot_id": resp["snapshot_id"],
         }
 
     def get_album_songs(
@@ -393,51 +545,51 @@ class RespotRequest:
         self, album_id: SpotifyAlbumId, artist_id: SpotifyArtistId
     ) -> PackedSongs:
         """Returns album tracklist"""
-        audios: PackedSongs = []
-        offset = 0
-        limit = 50
         include_groups = "album,compilation"
 
-        # db only needs song_id, album_id, artist_id, name, quality
+        quality_kbps = self.get_quality_kbps()
+
+        songs = self.get_all_items(
+            f"https://api.spotify.com/v1/albums/{album_id}/tracks",
+            limit=50,
+            params={"include_groups": include_groups},
+        )
+        return [
+            self.pack_album_song(song, album_id, artist_id, quality_kbps)
+            for song in songs
+        ]
+
+    def get_quality_kbps(self) -> int:
         quality = self.auth.get_quality()
 
         if quality == AudioQuality.HIGH:
-            quality_kbps = 160
+            return 160
         elif quality == AudioQuality.VERY_HIGH:
-            quality_kbps = 320
+            return 320
         else:
-            quality_kbps = 0
+            return 0
 
-        while True:
-            resp = self.authorized_get_request(
-                f"https://api.spotify.com/v1/albums/{album_id}/tracks",
-                params={
-                    "limit": limit,
-                    "include_groups": include_groups,
-                    "offset": offset,
-                },
-            ).json()
-            offset += limit
-            for song in resp["items"]:
-                audios.append(
-                    {
-                        "id": song["id"],
-                        "name": song["name"],
-                        "track_number": song["track_number"],
-                        "disc_number": song["disc_number"],
-                        "quality_kbps": quality_kbps,
-                        "album_id": album_id,
-                        "artist_id": artist_id,
-                    }
-                )
-
-            if len(resp["items"]) < limit:
-                break
-
-        return audios
+    @staticmethod
+    def pack_album_song(
+        song: dict, album_id: SpotifyAlbumId, artist_id: SpotifyArtistId, quality_kbps: int
+    ) -> dict:
+        # db only needs song_id, album_id, artist_id, name, quality
+        return {
+            "id": song["id"],
+            "name": song["name"],
+            "track_number": song["track_number"],
+            "disc_number": song["disc_number"],
+            "quality_kbps": quality_kbps,
+            "album_id": album_id,
+            "artist_id": artist_id,
+        }
 
     def get_album_info(self, album_id):
         """Returns album name"""
+        # prefetched with the artist's discography, only used once so drop it
+        if (info := self.album_info_cache.pop(album_id, None)) is not None:
+            return info
+
         album_resp = self.authorized_get_request(
             f"https://api.spotify.com/v1/albums/{album_id}"
         )
@@ -445,8 +597,49 @@ class RespotRequest:
         if album_resp is None:
             return None
 
-        resp = album_resp.json()
+        return self.parse_album_info(album_resp.json())
+
+    def prefetch_albums_info(
+        self, album_ids: list[SpotifyAlbumId], artist_id: SpotifyArtistId
+    ) -> None:
+        """Resolves album info for get_album_info, MAX_ALBUM_IDS_PER_REQUEST per request.
+        Complete tracklists embedded in the response are stored so get_album_songs needs no request
+        """
+        missing = [
+            album_id for album_id in album_ids if album_id not in self.album_info_cache
+        ]
+        quality_kbps = self.get_quality_kbps()
+
+        for i in range(0, len(missing), MAX_ALBUM_IDS_PER_REQUEST):
+            ids = missing[i : i + MAX_ALBUM_IDS_PER_REQUEST]
+            albums_request = self.authorized_get_request(
+                f"{SPOTIFY_API}/albums",
+                params={"ids": ",".join(ids), "market": "from_token"},
+            )
+            if albums_request is None:
+                continue
+
+            # albums come back in the order requested, unknown ids as null
+            for album_id, album in zip(ids, albums_request.json()["albums"]):
+                if album is None:
+                    continue
+                self.album_info_cache[album_id] = self.parse_album_info(album)
+
+                # only the first page of tracks is embedded, longer albums are paged later
+                tracks = album["tracks"]
+                if tracks["next"] is None and not db_manager.have_all_album_songs(album_id):
+                    db_manager.store_album_songs(
+                        [
+                            self.pack_album_song(song, album_id, artist_id, quality_kbps)
+                            for song in tracks["items"]
+                        ]
+                    )
+                    db_manager.set_have_album_songs(album_id, True)
 
+            db_manager.request_commit()
+
+    @staticmethod
+    def parse_album_info(resp: dict) -> dict:
         artists = []
         for artist in resp["artists"]:
             artists.append(FormatUtils.sanitize_data(artist["name"]))
@@ -466,10 +659,19 @@ class RespotRequest:
                 "release_date": resp["release_date"],
             }
 
-    def get_artist_albums(self, artist_id) -> list[SpotifyAlbumId]:
+    def claim_album_refresh(self, artist_id: SpotifyArtistId) -> bool:
+        """True if the artist's stored album listing is stale and is to be queried again this run"""
+        return db_manager.have_all_artist_albums(
+            artist_id
+        ) and self.auth.album_refresh.claim(
+            db_manager.get_artist_albums_checked(artist_id)
+        )
+
+    def get_artist_albums(self, artist_id, refresh: bool = False) -> list[SpotifyAlbumId]:
         if (
             not db_manager.have_all_artist_albums(artist_id)
             or self.auth.force_album_query
+            or refresh
         ):
             logger.info(f"need to request artist {artist_id}'s albums from spotify")
             all_artist_albums = self.request_all_artist_albums(artist_id)
@@ -483,16 +685,13 @@ class RespotRequest:
 
     def request_all_artist_albums(self, artist_id: SpotifyArtistId) -> PackedAlbums:
         """returns list of albums in an artist"""
-
-        offset = 0
-        limit = 50
         include_groups = "album,compilation,single"
 
-        resp = self.authorized_get_request(
+        return self.get_all_items(
             f"https://api.spotify.com/v1/artists/{artist_id}/albums",
-            params={"limit": limit, "include_groups": include_groups, "offset": offset},
-        ).json()
-        return resp["items"]
+            limit=50,
+            params={"include_groups": include_groups},
+        )
 
     def get_artist_info(self, artist_id: SpotifyArtistId) -> ArtistInfo:
         """returns list of albums in an artist"""
@@ -509,26 +708,15 @@ class RespotRequest:
     def get_liked_tracks(self):
         """Returns user's saved tracks"""
         songs = []
-        offset = 0
-        limit = 50
 
-        while True:
-            resp = self.authorized_get_request(
-                API_ME + "tracks",
-                params={"limit": limit, "offset": offset},
-            ).json()
-            offset += limit
-            for song in resp["items"]:
-                songs.append(
-                    {
-                        "id": song["track"]["id"],
-                        "name": song["track"]["name"],
-                        "artist": song["track"]["artists"][0]["name"],
-                    }
-                )
-
-            if len(resp["items"]) < limit:
-                break
+        for song in self.get_all_items(f"{API_ME}/tracks", limit=50):
+            songs.append(
+                {
+                    "id": song["track"]["id"],
+                    "name": song["track"]["name"],
+                    "artist": song["track"]["artists"][0]["name"],
+                }
+            )
 
         return songs
 
@@ -564,26 +752,17 @@ class RespotRequest:
     def get_show_episodes(self, show_id):
         """returns episodes of a show"""
         episodes = []
-        offset = 0
-        limit = 50
 
-        while True:
-            resp = self.authorized_get_request(
-                f"https://api.spotify.com/v1/shows/{show_id}/episodes",
-                params={"limit": limit, "offset": offset},
-            ).json()
-            offset += limit
-            for episode in resp["items"]:
-                episodes.append(
-                    {
-                        "id": episode["id"],
-                        "name": episode["name"],
-                        "release_date": episode["release_date"],
-                    }
-                )
-
-            if len(resp["items"]) < limit:
-                break
+        for episode in self.get_all_items(
+            f"https://api.spotify.com/v1/shows/{show_id}/episodes", limit=50
+        ):
+            episodes.append(
+                {
+                    "id": episode["id"],
+                    "name": episode["name"],
+                    "release_date": episode["release_date"],
+                }
+            )
 
         return episodes
 
@@ -689,47 +868,98 @@ class RespotRequest:
         if (
             not db_manager.have_all_liked_artists()
             or self.auth.force_liked_artist_query
+            # dbs from before the watermark was stored need one full query first
+            or (
+                self.auth.sync_liked_artist_query
+                and db_manager.get_liked_watermark() is None
+            )
         ):
             logger.info(
                 f"{'[Forced] ' if self.auth.force_liked_artist_query else ''}need to request liked artists from spotify"
             )
-            all_liked_spotify_artists = self.request_all_liked_artists()
+            liked_songs = self.get_all_items(f"{API_ME}/tracks", limit=50)
 
             # store in db
-            db_manager.store_all_liked_artists(all_liked_spotify_artists)
+            db_manager.store_all_liked_artists(self.pack_song_artists(liked_songs))
+            # newest first, the next incremental query stops at this one
+            if liked_songs:
+                db_manager.set_liked_watermark(liked_songs[0]["added_at"])
 
             db_manager.set_have_all_liked_artist(True, should_commit=True)
 
+        elif self.auth.sync_liked_artist_query:
+            self.sync_liked_artists()
+
         # for consistency, always get result from db
         return db_manager.get_all_liked_artist_ids()
 
-    def request_all_liked_artists(self) -> List[PackedArtists]:
-        return self.request_all_playlist_artists(f"{API_ME}/tracks")
-
-    def request_all_playlist_artists(self, link: str) -> List[PackedArtists]:
-        packed_artists: PackedArtists = []
+    def sync_liked_artists(self) -> None:
+        """Adds the artists and track metadata of songs liked since the last query.
+        Pages from the newest liked song and stops at the first one already seen
+        """
+        watermark = db_manager.get_liked_watermark()
+        new_songs = []
         offset = 0
         limit = 50
 
         while True:
-            # f"{API_PLAYLIST}/{playlist_id}/tracks"
             resp = self.authorized_get_request(
-                link,
-                params={"limit": limit, "offset": offset},
+                f"{API_ME}/tracks",
+                params={"limit": limit, "offset": offset, "market": "from_token"},
             ).json()
-
             offset += limit
-            try:
-                for song in resp["items"]:
-                    id = str(song["track"]["artists"][0]["id"])
-                    name = str(song["track"]["artists"][0]["name"])
-                    packed_artists.append((id, name))
-            except KeyError:
-                logger.error(f"Failed to get artists for offset: {offset}, continuing")
-                continue
-            if len(resp["items"]) < limit:
+
+            # added_at is an ISO 8601 UTC timestamp, they compare as strings
+            page = [song for song in resp["items"] if song["added_at"] > watermark]
+            new_songs.extend(page)
+
+            if len(page) < len(resp["items"]) or resp["next"] is None:
                 break
 
+        logger.info(f"{len(new_songs)} songs liked since {watermark}")
+        if not new_songs:
+            return
+
+        db_manager.store_all_liked_artists(self.pack_song_artists(new_songs))
+        for song in new_songs:
+            # local files have no id and nothing to tag from
+            if song["track"] is not None and song["track"]["id"] is not None:
+                track_id = song["track"]["id"]
+                db_manager.store_track_metadata(self.parse_track_info(track_id, song["track"]))
+
+        db_manager.set_liked_watermark(new_songs[0]["added_at"], should_commit=True)
+
+    def get_playlist_artists(self, playlist_id: str, snapshot_id: str) -> PackedArtists:
+        """Playlist artists from the db while the playlist is unchanged since they were stored"""
+        if db_manager.get_playlist_snapshot(playlist_id) == snapshot_id:
+            logger.info(f"playlist {playlist_id} unchanged, using stored artists")
+            return db_manager.get_playlist_artists(playlist_id)
+
+        packed_artists = self.request_all_playlist_artists(
+            f"{API_PLAYLIST}/{playlist_id}/tracks"
+        )
+        db_manager.store_playlist_artists(
+            playlist_id, snapshot_id, packed_artists, should_commit=True
+        )
+        return packed_artists
+
+    def request_all_playlist_artists(self, link: str) -> List[PackedArtists]:
+        # f"{API_PLAYLIST}/{playlist_id}/tracks"
+        return self.pack_song_artists(self.get_all_items(link, limit=50))
+
+    @staticmethod
+    def pack_song_artists(songs: list[dict]) -> List[PackedArtists]:
+        """Main artist of each playlist or liked songs item, without duplicates"""
+        packed_artists: PackedArtists = []
+
+        for offset, song in enumerate(songs):
+            try:
+                id = str(song["track"]["artists"][0]["id"])
+                name = str(song["track"]["artists"][0]["name"])
+                packed_artists.append((id, name))
+            except (KeyError, TypeError):
+                logger.error(f"Failed to get artist for offset: {offset}, continuing")
+
         # insert all these artists into artist table
         # upsert all artists table so next time we dont have to call this
 
@@ -800,16 +1030,17 @@ class RespotTrackHandler:
     CHUNK_SIZE = 50000
     RETRY_DOWNLOAD = 30
 
-    def __init__(self, auth, audio_format, antiban_wait_time, quality):
+    def __init__(self, auth, audio_format, quality, transcoder):
         """
         Args:
             audio_format (str): The desired format for the converted audio.
             quality (str): The quality setting of Spotify playback.
+            transcoder: Backend used by convert_audio_format (ffmpeg pipe or pydub).
         """
         self.auth = auth
         self.format = audio_format
-        self.antiban_wait_time = antiban_wait_time
         self.quality = quality
+        self.transcoder = transcoder
 
     def create_out_dirs(self, parent_path) -> None:
         parent_path.mkdir(parents=True, exist_ok=True)
@@ -818,21 +1049,63 @@ class RespotTrackHandler:
         """Downloads raw song audio from Spotify"""
         # TODO: ADD disc_number IF > 1
 
+        stream = self._load_stream(track_id)
+        audio_bytes = BytesIO()
+
+        if self._read_stream(stream, track_id, audio_bytes) is None:
+            return None
+
+        audio_bytes.seek(0)
+
+        return audio_bytes
+
+    def download_audio_to_file(self, track_id, part_path: Path) -> Optional[Path]:
+        """Streams raw song audio from Spotify into a preallocated file chunk by chunk"""
+        stream = self._load_stream(track_id)
+        total_size = stream.input_stream.size
+
+        with open(part_path, "wb") as part_file:
+            if hasattr(os, "posix_fallocate"):
+                try:
+                    os.posix_fallocate(part_file.fileno(), 0, total_size)
+                except OSError:
+                    pass  # not supported by every filesystem, only an optimization
+
+            downloaded = self._read_stream(stream, track_id, part_file)
+            if downloaded is None:
+                return None
+
+            # stream may end early, drop the unused preallocated tail
+            part_file.truncate(downloaded)
+
+        return part_path
+
+    def _load_stream(self, track_id):
+        # antiban spacing only holds back stream requests, not local work
+        request_scheduler.wait_turn("track")
         try:
             _track_id = TrackId.from_base62(track_id)
-            stream = self.auth.session.content_feeder().load(
+            return self.auth.session.content_feeder().load(
                 _track_id, VorbisOnlyAudioQuality(self.quality), False, None
             )
         except ApiClient.StatusCodeException:
             _track_id = EpisodeId.from_base62(track_id)
-            stream = self.auth.session.content_feeder().load(
+            return self.auth.session.content_feeder().load(
                 _track_id, VorbisOnlyAudioQuality(self.quality), False, None
             )
 
+    def _read_stream(self, stream, track_id, sink) -> Optional[int]:
+        """Copies the stream into sink, returns the number of bytes written or None on failure"""
+        try:
+            return self._copy_stream(stream, track_id, sink)
+        finally:
+            # next stream waits antiban time from the end of this one
+            request_scheduler.release("track")
+
+    def _copy_stream(self, stream, track_id, sink) -> Optional[int]:
         total_size = stream.input_stream.size
         downloaded = 0
         fail_count = 0
-        audio_bytes = BytesIO()
         progress_bar = tqdm(total=total_size, unit="B", unit_scale=True)
 
         while downloaded < total_size:
@@ -844,6 +1117,7 @@ class RespotTrackHandler:
                 data = stream.input_stream.stream().read(read_size)
             except IndexError as e:
                 logger.error(f"stream download failed with id: {track_id}", exc_info=e)
+                progress_bar.close()
                 return None
 
             if not data:
@@ -855,36 +1129,40 @@ class RespotTrackHandler:
 
             downloaded += len(data)
             progress_bar.update(len(data))
-            audio_bytes.write(data)
+            sink.write(data)
 
         progress_bar.close()
 
-        # Sleep to avoid ban
-        time.sleep(self.antiban_wait_time)
+        return downloaded
 
-        audio_bytes.seek(0)
-
-        return audio_bytes
-
-    def convert_audio_format(self, audio_bytes: BytesIO, output_path: Path) -> None:
+    def convert_audio_format(
+        self, audio: BytesIO | Path, output_path: Path, tag=None
+    ) -> None:
         """Converts raw audio (ogg vorbis) to user specified format"""
-        # Make sure stream is at the start or else AudioSegment will act up
-        audio_bytes.seek(0)
+        if self.transcoder is None:
+            raise RuntimeError(NO_TRANSCODER_ERROR)
+        bitrate = self.get_bitrate()
 
-        bitrate = "160k"
-        if self.quality == AudioQuality.VERY_HIGH:
-            bitrate = "320k"
+        # export next to the target and move it in place once complete
+        part_path = part_path_for(output_path)
+        try:
+            self.transcoder.transcode(audio, part_path, self.format, bitrate)
+        except BaseException:
+            part_path.unlink(missing_ok=True)
+            raise
+        finish_part(part_path, output_path, tag)
 
-        AudioSegment.from_file(audio_bytes).export(
-            output_path, format=self.format, bitrate=bitrate
-        )
+    def get_bitrate(self) -> str:
+        if self.quality == AudioQuality.VERY_HIGH:
+            return "320k"
+        return "160k"
 
     def bytes_to_file(self, audio_bytes: BytesIO, output_path: Path) -> None:
         output_path.write_bytes(audio_bytes.getvalue())
 
     @staticmethod
-    def determine_file_extension(audio_bytes: BytesIO) -> str:
-        """Get MIME type from BytesIO object"""
+    def determine_file_extension(audio_bytes: BinaryIO) -> str:
+        """Get MIME type from BytesIO or binary file object"""
         audio_bytes.seek(0)
         magic_bytes = audio_bytes.read(16)
 
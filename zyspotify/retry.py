@@ -0,0 +1,150 @@
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import requests
+
+logger = logging.getLogger()
+
+MAX_RETRIES = 10
+BACKOFF_BASE_SEC = 2
+BACKOFF_MAX_SEC = 120
+
+# process wide, every worker thread draws from the same budget
+RETRY_BUDGET_TOKENS = 60
+RETRY_BUDGET_REFILL_PER_SEC = 0.5
+
+
+class RetryRule:
+    """How a response status is retried"""
+
+    def __init__(
+        self,
+        retry: bool = True,
+        backoff: bool = True,
+        honor_retry_after: bool = False,
+        pause_all: bool = False,
+    ):
+        """
+        Args:
+            retry (bool): False hands the response back to the caller as is.
+            backoff (bool): Wait with jittered exponential backoff before retrying.
+            honor_retry_after (bool): Wait at least as long as the Retry-After header asks.
+            pause_all (bool): Hold back every worker, not just the one that got the response.
+        """
+        self.retry = retry
+        self.backoff = backoff
+        self.honor_retry_after = honor_retry_after
+        self.pause_all = pause_all
+
+
+STATUS_RULES = {
+    # token is refreshed by the caller, retry right away
+    401: RetryRule(backoff=False),
+    404: RetryRule(retry=False),
+    429: RetryRule(honor_retry_after=True, pause_all=True),
+    503: RetryRule(honor_retry_after=True, pause_all=True),
+}
+
+# connection errors, timeouts, empty bodies and any other status
+DEFAULT_RULE = RetryRule()
+
+
+class RetryBudget:
+    """Token bucket limiting how many retries the whole process may do"""
+
+    def __init__(self, tokens: float, refill_per_sec: float):
+        self.capacity = tokens
+        self.tokens = tokens
+        self.refill_per_sec = refill_per_sec
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity,
+                self.tokens + (now - self.last_refill) * self.refill_per_sec,
+            )
+            self.last_refill = now
+
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RetryPolicy:
+    def __init__(self) -> None:
+        self.budget = RetryBudget(RETRY_BUDGET_TOKENS, RETRY_BUDGET_REFILL_PER_SEC)
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def rule_for(response: Optional[requests.Response]) -> RetryRule:
+        if response is None:
+            return DEFAULT_RULE
+        return STATUS_RULES.get(response.status_code, DEFAULT_RULE)
+
+    def should_retry(self, response: Optional[requests.Response]) -> bool:
+        return self.rule_for(response).retry
+
+    def wait_for_pause(self) -> None:
+        """Blocks while a rate limit pause set by any worker is in effect"""
+        while (remaining := self.paused_until - time.monotonic()) > 0:
+            time.sleep(remaining)
+
+    def backoff(self, attempt: int, response: Optional[requests.Response] = None) -> None:
+        """Sleeps before retry number attempt, raises RuntimeError once retries are used up"""
+        if attempt > MAX_RETRIES:
+            logger.critical(f"Max retries ({MAX_RETRIES}) reached.")
+            raise RuntimeError("Connection Error: Too many retries")
+
+        if not self.budget.try_acquire():
+            logger.critical("Process wide retry budget exhausted.")
+            raise RuntimeError("Connection Error: Retry budget exhausted")
+
+        rule = self.rule_for(response)
+
+        delay = 0.0
+        if rule.backoff:
+            # equal jitter, keeps at least half of the exponential delay
+            cap = min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * 2 ** (attempt - 1))
+            delay = cap / 2 + random.uniform(0, cap / 2)
+
+        if rule.honor_retry_after and response is not None:
+            delay = max(delay, self.parse_retry_after(response) or 0)
+
+        if rule.pause_all:
+            logger.warning(f"Rate limited, pausing all requests for {delay:.1f}s")
+            with self.lock:
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            self.wait_for_pause()
+        else:
+            time.sleep(delay)
+
+    @staticmethod
+    def parse_retry_after(response: requests.Response) -> Optional[float]:
+        """Retry-After is either delay seconds or an http date"""
+        value = response.headers.get("Retry-After")
+        if value is None:
+            return None
+
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+retry_policy = RetryPolicy()
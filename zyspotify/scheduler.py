@@ -0,0 +1,44 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger()
+
+
+class RequestScheduler:
+    """Enforces antiban spacing between Spotify facing requests only.
+
+    Callers block just before the request that needs pacing, so tagging,
+    transcoding and file moves running on other threads are never held up.
+    """
+
+    def __init__(self) -> None:
+        self.spacing: dict[str, float] = {}
+        self.next_slot: dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def set_spacing(self, kind: str, seconds: float) -> None:
+        with self.lock:
+            self.spacing[kind] = seconds
+
+    def wait_turn(self, kind: str) -> None:
+        """Reserves the next free slot for kind and sleeps until it comes up"""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(kind, 0.0))
+            self.next_slot[kind] = slot + self.spacing.get(kind, 0.0)
+
+        if (delay := slot - now) > 0:
+            logger.debug(f"Antiban: waiting {delay:.1f}s before next {kind}")
+            time.sleep(delay)
+
+    def release(self, kind: str) -> None:
+        """Starts the spacing for kind from now, for work that should be followed by a gap"""
+        with self.lock:
+            self.next_slot[kind] = max(
+                self.next_slot.get(kind, 0.0),
+                time.monotonic() + self.spacing.get(kind, 0.0),
+            )
+
+
+request_scheduler = RequestScheduler()
@@ -1,28 +1,108 @@
 import music_tag
 import requests
 from mutagen import id3
+import functools
 import logging
-from time import sleep
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+from .art_cache import DEFAULT_ART_QUALITY, ArtCache, normalize_cover_art
+from .http_client import http_client
+from .retry import retry_policy
 logger = logging.getLogger()
 
 
-def generic_get_request(url: str, retry_count: int = 0) -> requests.Response:
-    if retry_count > 10:
-        raise RuntimeError("ConnectionError: generic_get_request retries exceeded")
+def generic_get_request(url: str) -> requests.Response:
+    attempt = 0
 
-    try:
-        return requests.get(url, timeout=5)
-    except requests.exceptions.RequestException as e:
-        logger.error(
-            f"generic_get_request RequestException: {'response had type none' if e.response is None else e.response.text}"
-        )
-        sleep(30)
-        return generic_get_request(url, retry_count+1)
+    while True:
+        retry_policy.wait_for_pause()
+        response = None
+
+        try:
+            response = http_client.get(url, timeout=5)
+            response.raise_for_status()
+            return response
+        except requests.exceptions.RequestException as e:
+            if response is not None and not retry_policy.should_retry(response):
+                return response
+
+            logger.error(
+                f"generic_get_request RequestException: {'response had type none' if e.response is None else e.response.text}"
+            )
+
+        attempt += 1
+        retry_policy.backoff(attempt, response)
+
+
+def fetch_cover_art(url: str) -> Optional[bytes]:
+    response = generic_get_request(url)
+    return response.content if response.ok else None
+
+
+def fetch_normalized_cover_art(url: str, max_size: int, quality: int) -> Optional[bytes]:
+    if (data := fetch_cover_art(url)) is None:
+        return None
+    return normalize_cover_art(data, max_size, quality)
 
 
 class AudioTagger:
-    def __init__(self):
-        pass
+    def __init__(
+        self,
+        art_cache_dir: Optional[Path] = None,
+        art_cache_bytes: int = 0,
+        art_max_size: int = 0,
+        art_quality: int = 0,
+        cover_art: str = "embed",
+    ):
+        """
+        Args:
+            art_max_size (int): Covers are scaled down to fit this many pixels, 0 keeps them as served.
+            art_quality (int): JPEG quality covers are re-encoded at, 0 keeps them as served unless resized.
+            cover_art (str): "embed" in every file, "file" as one cover.jpg per album folder, or "both".
+        """
+        self.embed_art = cover_art in ("embed", "both")
+        self.cover_file = cover_art in ("file", "both")
+
+        if art_max_size > 0 or art_quality > 0:
+            quality = art_quality or DEFAULT_ART_QUALITY
+            # processed once per album, the cache keeps the result
+            self.art_cache = ArtCache(
+                functools.partial(
+                    fetch_normalized_cover_art, max_size=art_max_size, quality=quality
+                ),
+                art_cache_dir,
+                art_cache_bytes,
+                variant=f"{art_max_size}px-q{quality}",
+            )
+        else:
+            self.art_cache = ArtCache(fetch_cover_art, art_cache_dir, art_cache_bytes)
+
+    def write_cover_file(self, directory: Path, image_url: str) -> None:
+        """Writes directory/cover.jpg once, for players that read the folder's cover"""
+        cover_path = directory / "cover.jpg"
+        if not image_url or cover_path.exists():
+            return
+
+        albumart = self.art_cache.get(image_url)
+        if not albumart:
+            return
+
+        # tracks of one album finish concurrently, each writes its own temp file.
+        # the cover is only a convenience, failing to write it does not fail the track
+        part_path = None
+        try:
+            with tempfile.NamedTemporaryFile(
+                dir=directory, prefix="cover.", suffix=".part", delete=False
+            ) as part_file:
+                part_path = Path(part_file.name)
+                part_file.write(albumart)
+            os.replace(part_path, cover_path)
+        except OSError as e:
+            logger.warning(f"Could not write {cover_path}: {e}")
+            if part_path is not None:
+                part_path.unlink(missing_ok=True)
 
     def set_audio_tags(
         self,
@@ -36,15 +116,16 @@ class AudioTagger:
         track_id_str=None,
         album_artist=None,
         image_url=None,
-    ):
-        """sets music_tag metadata using mutagen if possible"""
+    ) -> bool:
+        """sets music_tag metadata using mutagen if possible.
+        Returns False if the file already had these tags and was left untouched"""
 
         album_artist = album_artist or artists  # Use artists if album_artist is None
 
         extension = str(fullpath).split(".")[-1]
 
         if extension == "mp3":
-            self._set_mp3_tags(
+            return self._set_mp3_tags(
                 fullpath,
                 artists,
                 name,
@@ -57,7 +138,7 @@ class AudioTagger:
                 image_url,
             )
         else:
-            self._set_other_tags(
+            return self._set_other_tags(
                 fullpath,
                 artists,
                 name,
@@ -98,18 +179,32 @@ class AudioTagger:
             "TPE2": album_artist,
         }
 
+        changed = False
         for tag, value in mp3_map.items():
-            if value:
-                tags[tag] = id3.Frames[tag](encoding=3, text=value)
-
-        if image_url:
-            albumart = generic_get_request(image_url).content
-            if albumart:
-                tags["APIC"] = id3.APIC(
-                    encoding=3, mime="image/jpeg", type=3, desc="0", data=albumart
+            if value and not any(
+                [str(text) for text in frame.text] == [str(value)]
+                for frame in tags.getall(tag)
+            ):
+                # loaded frames are keyed like COMM::XXX, replace them instead of adding a copy
+                tags.delall(tag)
+                tags.add(id3.Frames[tag](encoding=3, text=value))
+                changed = True
+
+        if image_url and self.embed_art:
+            albumart = self.art_cache.get(image_url)
+            if albumart and not any(
+                frame.data == albumart for frame in tags.getall("APIC")
+            ):
+                tags.delall("APIC")
+                tags.add(
+                    id3.APIC(encoding=3, mime="image/jpeg", type=3, desc="0", data=albumart)
                 )
+                changed = True
 
-        tags.save()
+        # rewriting identical tags is skipped, re-running --retag only reads files
+        if changed:
+            tags.save()
+        return changed
 
     def _set_other_tags(
         self,
@@ -137,13 +232,19 @@ class AudioTagger:
             else None,
         }
 
+        changed = False
         for tag, value in other_map.items():
-            if value:
+            if value and str(tags[tag]) != str(value):
                 tags[tag] = value
+                changed = True
 
-        if image_url:
-            albumart = generic_get_request(image_url).content
-            if albumart:
+        if image_url and self.embed_art:
+            albumart = self.art_cache.get(image_url)
+            artwork = tags["artwork"].first
+            if albumart and (artwork is None or artwork.raw != albumart):
                 tags["artwork"] = albumart
+                changed = True
 
-        tags.save()
+        if changed:
+            tags.save()
+        return changed
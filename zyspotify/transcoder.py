@@ -0,0 +1,181 @@
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, Optional
+
+from pydub import AudioSegment
+
+logger = logging.getLogger()
+
+TRANSCODERS = ["ffmpeg", "pydub"]
+NO_TRANSCODER_ERROR = "Converting audio needs ffmpeg (or avconv) on PATH, install it or use --audio-format source"
+
+
+class FFmpegTranscoder:
+    """Pipes the source audio through a single ffmpeg process in chunks"""
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, ffmpeg_path: str):
+        self.ffmpeg_path = ffmpeg_path
+
+    def transcode(
+        self, audio: BytesIO | Path, output_path: Path, audio_format: str, bitrate: str
+    ) -> None:
+        command = [
+            self.ffmpeg_path,
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-y",
+            "-i",
+            "pipe:0",
+            "-vn",
+            "-b:a",
+            bitrate,
+            "-f",
+            audio_format,
+            str(output_path),
+        ]
+
+        # stderr goes to a file so a chatty ffmpeg can never block on a full pipe
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(
+                command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr
+            )
+            try:
+                if isinstance(audio, BytesIO):
+                    audio.seek(0)
+                    self._feed(audio, process.stdin)
+                else:
+                    with open(audio, "rb") as audio_file:
+                        self._feed(audio_file, process.stdin)
+            except BrokenPipeError:
+                pass  # ffmpeg exited early, the return code below tells why
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+
+            if process.wait() != 0:
+                stderr.seek(0)
+                raise RuntimeError(
+                    f"ffmpeg failed converting {output_path.name}: {stderr.read().decode(errors='replace').strip()}"
+                )
+
+    def _feed(self, source, sink) -> None:
+        while chunk := source.read(self.CHUNK_SIZE):
+            sink.write(chunk)
+
+
+class PydubTranscoder:
+    """Decodes the whole file to wav in memory, then encodes it"""
+
+    def transcode(
+        self, audio: BytesIO | Path, output_path: Path, audio_format: str, bitrate: str
+    ) -> None:
+        # Make sure stream is at the start or else AudioSegment will act up
+        if isinstance(audio, BytesIO):
+            audio.seek(0)
+
+        AudioSegment.from_file(audio).export(
+            output_path, format=audio_format, bitrate=bitrate
+        )
+
+
+def get_transcoder(name: str) -> FFmpegTranscoder | PydubTranscoder:
+    """Returns the requested transcoder, falling back to pydub with avconv when ffmpeg is not on PATH.
+    pydub shells out to ffmpeg or avconv itself, raises RuntimeError if neither is installed"""
+    if ffmpeg_path := shutil.which("ffmpeg"):
+        return FFmpegTranscoder(ffmpeg_path) if name == "ffmpeg" else PydubTranscoder()
+
+    if shutil.which("avconv") is None:
+        raise RuntimeError(NO_TRANSCODER_ERROR)
+
+    if name == "ffmpeg":
+        logger.warning("ffmpeg not found on PATH, falling back to pydub transcoder with avconv")
+    return PydubTranscoder()
+
+
+def part_path_for(output_path: Path) -> Path:
+    """Temp file an output is written to before it moves in place.
+    Keeps the extension, taggers pick the format from it"""
+    return output_path.with_name(f"{output_path.stem}.part{output_path.suffix}")
+
+
+def finish_part(
+    part_path: Path, output_path: Path, tag: Optional[Callable[[Path], None]] = None
+) -> Path:
+    """Tags the complete temp file if asked and moves it in place, the output is only written once"""
+    try:
+        if tag is not None:
+            tag(part_path)
+        os.replace(part_path, output_path)
+    finally:
+        part_path.unlink(missing_ok=True)
+
+    return output_path
+
+
+def transcode_file(
+    backend: str,
+    source_path: Path,
+    output_path: Path,
+    audio_format: str,
+    bitrate: str,
+    keep_part: bool = False,
+) -> Path | tuple[Path, Path]:
+    """Converts source_path into output_path atomically and removes the source. Runs in a pool process.
+    keep_part returns (temp file, output_path) instead, for the caller to tag and move with finish_part"""
+    part_path = part_path_for(output_path)
+    try:
+        get_transcoder(backend).transcode(source_path, part_path, audio_format, bitrate)
+        if keep_part:
+            return part_path, output_path
+        os.replace(part_path, output_path)
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
+    finally:
+        source_path.unlink(missing_ok=True)
+
+    return output_path
+
+
+class TranscodePool:
+    """Runs conversions in worker processes so encoding overlaps with downloading"""
+
+    def __init__(self, backend: str, max_workers: int):
+        self.backend = backend
+        # spawn, forking a process that is running download threads is not safe
+        self.executor = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def submit(
+        self,
+        source_path: Path,
+        output_path: Path,
+        audio_format: str,
+        bitrate: str,
+        keep_part: bool = False,
+    ) -> Future:
+        return self.executor.submit(
+            transcode_file,
+            self.backend,
+            source_path,
+            output_path,
+            audio_format,
+            bitrate,
+            keep_part,
+        )
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False) -> None:
+        self.executor.shutdown(wait=wait, cancel_futures=cancel_futures)
@@ -13,3 +13,33 @@ class FormatUtils:
         for char in SANITIZE_CHARS:
             value = value.replace(char, " " if char != "|" else "-")
         return value
+
+
+class IdUtils:
+    """Conversions between Spotify base62 ids and the 128 bit integers they encode."""
+
+    BASE62 = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    ID_LENGTH = 22
+
+    def base62_to_int(value: str) -> int | None:
+        """Returns None if value is not a spotify base62 id"""
+        if len(value) != IdUtils.ID_LENGTH:
+            return None
+
+        number = 0
+        for char in value:
+            digit = IdUtils.BASE62.find(char)
+            if digit < 0:
+                return None
+            number = number * 62 + digit
+        # 22 base62 digits reach past 128 bits, spotify ids never do
+        if number >= 1 << 128:
+            return None
+        return number
+
+    def int_to_base62(number: int) -> str:
+        chars = []
+        for _ in range(IdUtils.ID_LENGTH):
+            number, digit = divmod(number, 62)
+            chars.append(IdUtils.BASE62[digit])
+        return "".join(reversed(chars))